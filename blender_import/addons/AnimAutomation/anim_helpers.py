@@ -2,7 +2,6 @@
 import bpy
 from AnimAutomation import create_game_rig
 import blender_auto_common
-import math
 
 
 class ConstrainGameRig(bpy.types.Operator):
@@ -120,21 +119,16 @@ class CalcFootSpeed(bpy.types.Operator):
             fc_y = act.fcurves.find('pose.bones["%s"].location' % ft, index=1)
             down_frame = down_markers[pref].frame
             up_frame = up_markers[pref].frame
-            x_kf_up = blender_auto_common.get_fcurve_keyframe_at_frame(up_frame, fc_x)[1]
-            x_kf_down = blender_auto_common.get_fcurve_keyframe_at_frame(down_frame, fc_x)[1]
-            y_kf_up = blender_auto_common.get_fcurve_keyframe_at_frame(up_frame, fc_y)[1]
-            y_kf_down = blender_auto_common.get_fcurve_keyframe_at_frame(down_frame, fc_y)[1]
-            if x_kf_up is None or x_kf_down is None or y_kf_up is None or y_kf_down is None:
+            # reads keyframes once per fcurve, then finds both marker frames with one binary search
+            x_up, x_down = blender_auto_common.values_at_keyframes(fc_x, (up_frame, down_frame))
+            y_up, y_down = blender_auto_common.values_at_keyframes(fc_y, (up_frame, down_frame))
+            if x_up is None or x_down is None or y_up is None or y_down is None:
                 raise Exception("No key frames on fcurves at the up/down marker locations")
-            out[ft]['x_delta'] = x_kf_up.co[1] - x_kf_down.co[1]
-            out[ft]['y_delta'] = y_kf_up.co[1] - y_kf_down.co[1]
-            out[ft]['t_delta'] = float(up_frame) - float(down_frame)
-            if down_frame > up_frame:
-                out[ft]['t_delta'] += act.frame_range[1] - act.frame_range[0]  # plus b/c last frame needs to wrap to first
-            out[ft]['t_delta'] *= 1. / float(fps)
-            out[ft]['x_speed'] = out[ft]['x_delta'] / out[ft]['t_delta']
-            out[ft]['y_speed'] = out[ft]['y_delta'] / out[ft]['t_delta']
-            out[ft]['speed_mag'] = math.sqrt(out[ft]['x_speed'] ** 2 + out[ft]['y_speed'] ** 2)
+            speeds = blender_auto_common.compute_foot_speeds(x_up, x_down, y_up, y_down, float(up_frame),
+                                                             float(down_frame), float(fps),
+                                                             float(act.frame_range[1] - act.frame_range[0]))
+            for key, val in zip(('x_delta', 'y_delta', 't_delta', 'x_speed', 'y_speed', 'speed_mag'), speeds):
+                out[ft][key] = val
         return out
 
     @classmethod
@@ -42,18 +42,13 @@ class BatchBakeAnimsToRig(bpy.types.Operator):
 
         'action' is the bpy action object to search and delete nla track for.
         'obj' is the object that has the nla track to search"""
-        trs_to_delete = []  # Indices of nla tracks that have action
-        for i, tr in enumerate(obj.animation_data.nla_tracks):  # iter thru tracks and strips
-            for st in tr.strips:
-                if st.action is action:
-                    trs_to_delete.append(i)
-        # Just to be safe, deleting nla tracks via their indices (not holding to refs of
-        #     the nla tracks themselves since not sure if memory those refs point to
-        #     becomes invalid after deleting some elems from nla_tracks collection)
-        for i in trs_to_delete[::-1]:  # Going through list backwards to pop last elem first
-            tr = obj.animation_data.nla_tracks[i]
+        nla_tracks = obj.animation_data.nla_tracks
+        # Collect tracks first so collection isn't modified while iterating. Holding refs to the tracks is fine,
+        #     each track is its own allocation in a linked list, removing one doesn't move the others
+        trs_to_delete = [tr for tr in nla_tracks if any(st.action is action for st in tr.strips)]
+        for tr in trs_to_delete:
             print("    Overwrite: deleting NLA track: " + tr.name + " for action: " + action.name)
-            obj.animation_data.nla_tracks.remove(tr)
+            nla_tracks.remove(tr)
 
     def bake_ctrl_rig_track_to_game_rig(self, ctrl_track, game_rig_obj, context):
         """ Bake ctrl_track which should be an NLA track in ctrl rig to game_rig_obj NLA track.
@@ -66,10 +61,11 @@ class BatchBakeAnimsToRig(bpy.types.Operator):
             return None
         baked_action_name = self.prefix + ctrl_track.strips[0].name
         print("Baking action to game_rig: " + baked_action_name)
-        if context.blend_data.actions.find(baked_action_name) > -1:  # if action already exists with name
+        existing_action = context.blend_data.actions.get(baked_action_name)
+        if existing_action is not None:  # if action already exists with name
             if self.overwrite:  # delete action and any nla tracks containing it
-                self.delete_action_from_nla(context.blend_data.actions[baked_action_name], game_rig_obj)
-                context.blend_data.actions.remove(context.blend_data.actions[baked_action_name])
+                self.delete_action_from_nla(existing_action, game_rig_obj)
+                context.blend_data.actions.remove(existing_action)
             else:
                 print("    Overwrite: skipping: " + ctrl_track.strips[0].name + " action already exists, " +
                       "overwrite not enabled")
@@ -111,9 +107,9 @@ class BatchBakeAnimsToRig(bpy.types.Operator):
 
     def execute(self, context):
         """Bake all selected action in NLA track of ctrl_rig to the rig that is currently in pose mode"""
-        if context.scene.objects.find(self.ctrl_rig_name) < 0:
+        ctrl_rig_obj = context.scene.objects.get(self.ctrl_rig_name)
+        if ctrl_rig_obj is None:
             raise Exception("Could not find ctrl rig: " + self.ctrl_rig_name)
-        ctrl_rig_obj = context.scene.objects[self.ctrl_rig_name]
         game_rig_obj = blender_auto_common.find_object_in_mode('POSE', context=context)
 
         if ctrl_rig_obj is game_rig_obj:
@@ -1,44 +1,88 @@
 
 import bpy
-import mathutils
-from collections import OrderedDict
+import hashlib
+import json
+import numpy as np
 import blender_auto_common
 
 
 class EditBoneCopier:
     """Class to copy edit bones attributes.
 
-    Attributes to copy are listed in the class variable 'attrs_to_copy'. Will fill
-    out an OrderedDict, 'ctrl_rig_attrs', with all attribute data from all bones passed to
-    'copy_edit_bone_data()' method, keys will be bone names, vals will be a dict with
-    attribute name: attribute value"""
-    attrs_to_copy = ['envelope_distance', 'envelope_weight', 'head', 'head_radius',
-                     'inherit_scale', 'tail', 'tail_radius', 'use_connect', 'roll',
+    Attributes to copy are listed in the class variable 'attrs_to_copy'. Data is stored per attribute
+    rather than per bone for all bones passed to 'copy_edit_bone_data()' method: 'names' is a list of
+    the copied bone names in the order they were passed, 'parents' maps bone name: parent bone name (or
+    None) and 'ctrl_rig_attrs' maps attribute name: dict of bone name: attribute value.
+
+    Attributes in 'bulk_attrs' (head, tail, roll) are not copied per bone, they are read for all
+    bones at once with 'read_bulk_edit_bone_data()' into numpy arrays in 'bulk_data' and written
+    back to another armature with 'write_bulk_edit_bone_data()'"""
+    attrs_to_copy = ('envelope_distance', 'envelope_weight', 'head_radius',
+                     'inherit_scale', 'tail_radius', 'use_connect',
                      'use_deform', 'use_endroll_as_inroll', 'use_envelope_multiply',
-                     'use_inherit_rotation', 'use_local_location', 'use_relative_parent']
+                     'use_inherit_rotation', 'use_local_location', 'use_relative_parent')  # all scalars
+    bulk_attrs = {'head': 3, 'tail': 3, 'roll': 1}  # attribute name: number of floats per bone
 
     def __init__(self):
-        self.ctrl_rig_attrs = OrderedDict()
+        self.names = []
+        self.parents = {}
+        self.ctrl_rig_attrs = {at: {} for at in self.attrs_to_copy}
+        self.bulk_data = {}
+        self.bulk_index = {}  # bone name: row in bulk_data arrays
+
+    def read_bulk_edit_bone_data(self, edit_bones):
+        """Read 'bulk_attrs' of all bones in 'edit_bones' collection into numpy arrays with foreach_get"""
+        n = len(edit_bones)
+        self.bulk_index = {b.name: i for i, b in enumerate(edit_bones)}
+        for at, size in self.bulk_attrs.items():
+            arr = np.empty(n * size, dtype=np.float32)
+            edit_bones.foreach_get(at, arr)
+            self.bulk_data[at] = arr.reshape(n, size)
+
+    def write_bulk_edit_bone_data(self, edit_bones, src_names):
+        """Write 'bulk_attrs' to all bones in 'edit_bones' collection with foreach_set.
+
+        'src_names' is the name of the copied bone to take data from for each bone in 'edit_bones', in
+        the same order as 'edit_bones'"""
+        inds = [self.bulk_index[n] for n in src_names]
+        for at, arr in self.bulk_data.items():
+            edit_bones.foreach_set(at, arr[inds].ravel())
+
+    def get_bone_data_hash(self, bone_name, *extra):
+        """Return a hex digest of all data copied for 'bone_name' plus any 'extra' values, stable between
+        blender sessions"""
+        i = self.bulk_index[bone_name]
+        data = (bone_name, extra, self.parents[bone_name],
+                [self.ctrl_rig_attrs[at][bone_name] for at in self.attrs_to_copy],
+                [self.bulk_data[at][i].tolist() for at in self.bulk_attrs])
+        return hashlib.md5(repr(data).encode()).hexdigest()
+
+    def edit_bone_matches(self, edit_bone, bone_name, parent_name, tol=1e-5):
+        """Return True if 'edit_bone' (e.g. from another armature) is parented to 'parent_name' and has the same
+        bulk attribute values (head, tail, roll) as copied bone 'bone_name'"""
+        cur_parent = edit_bone.parent.name if edit_bone.parent else None
+        if cur_parent != parent_name:
+            return False
+        i = self.bulk_index[bone_name]
+        for at in self.bulk_attrs:
+            cur = np.atleast_1d(np.asarray(getattr(edit_bone, at), dtype=np.float32))
+            if not np.allclose(cur, self.bulk_data[at][i], rtol=0., atol=tol):
+                return False
+        return True
 
     def copy_edit_bone_data(self, ctrl_bone):
-        """Copy edit bone data from 'ctrl_bone' and stores in 'ctrl_rig_attrs'.
+        """Copy edit bone data from 'ctrl_bone' and stores in 'parents' and 'ctrl_rig_attrs'.
 
         'ctrl_bone' MUST be an edit bone, and passed in whatever order desired, this
-        class will keep track of that order through the use of an OrderedDict to
-        store the copied data.
+        class will keep track of that order in 'names'.
         """
-        self.ctrl_rig_attrs[ctrl_bone.name] = {}
-        if ctrl_bone.parent:  # Check if bone has parent and get name str
-            self.ctrl_rig_attrs[ctrl_bone.name]['parent'] = ctrl_bone.parent.name
-        else:
-            self.ctrl_rig_attrs[ctrl_bone.name]['parent'] = None
-        for at in self.attrs_to_copy:  # iter over attr_to_copy and copy values
-            if type(getattr(ctrl_bone, at)) is mathutils.Vector:
-                # Blender deallocates memory for vectors and matrices when leaving edit
-                #     mode, so need to make a copy to store
-                self.ctrl_rig_attrs[ctrl_bone.name][at] = getattr(ctrl_bone, at).copy()
-            else:
-                self.ctrl_rig_attrs[ctrl_bone.name][at] = getattr(ctrl_bone, at)
+        name = ctrl_bone.name
+        self.names.append(name)
+        self.parents[name] = ctrl_bone.parent.name if ctrl_bone.parent else None
+        # iter over attr_to_copy and copy values, vector attrs (head, tail) are all in bulk_attrs so no
+        #     need to copy values here (Blender deallocates vectors when leaving edit mode)
+        for at, vals in self.ctrl_rig_attrs.items():
+            vals[name] = getattr(ctrl_bone, at)
 
 
 class CreateGameRig(bpy.types.Operator):
@@ -71,12 +115,20 @@ class CreateGameRig(bpy.types.Operator):
     game_rig_name: bpy.props.StringProperty(name="Game Rig Name", default="game_rig",
         description="Name for the created Game Rig")
 
+    force_rebuild: bpy.props.BoolProperty(name="Force Rebuild", default=False,
+        description="Rewrite all game rig bones and constraints, otherwise only bones whose ctrl rig bone data "
+                    "changed since the last run are rewritten and constraints are only reapplied if the game rig "
+                    "bones changed")
+
+    cache_prop = "_game_rig_cache"  # game rig custom prop storing per bone data hashes from last run
+    constraint_fp_prop = "_constraint_fp"  # game rig custom prop storing fingerprint of last constraint pass
+
     @staticmethod
     def ctrl_to_game_rig_bone_name(ctrl_rig_bname, keep_gr_prop):
         if keep_gr_prop:
             return keep_gr_prop
         if "DEF-" in ctrl_rig_bname:
-            return "def-" + ctrl_rig_bname.split("DEF-", 1)[1]
+            return f"def-{ctrl_rig_bname.partition('DEF-')[2]}"
         return None
 
     @staticmethod
@@ -84,44 +136,51 @@ class CreateGameRig(bpy.types.Operator):
         if keep_gr_prop:
             return keep_gr_prop
         if "def-" in game_rig_bname:
-            return "DEF-" + game_rig_bname.split("def-", 1)[1]
+            return f"DEF-{game_rig_bname.partition('def-')[2]}"
         return None
 
+    @staticmethod
+    def game_rig_constraints_intact(game_rig_obj, ctrl_rig_obj):
+        """Return True if every game rig pose bone has its enabled loc and rot constraints to the matching ctrl rig bone
+        (i.e. constrain_game_rig would not change anything)"""
+        const_names = (blender_auto_common.game_to_ctrl_constraint_pref + "Loc",
+                       blender_auto_common.game_to_ctrl_constraint_pref + "Rot")
+        for bone in game_rig_obj.pose.bones:
+            cr_name = CreateGameRig.game_to_ctrl_rig_bone_name(bone.name, bone.get("KEEP_GAME_RIG"))
+            for const_name in const_names:
+                con = bone.constraints.get(const_name)
+                if con is None or not con.enabled or con.target is not ctrl_rig_obj or con.subtarget != cr_name:
+                    return False
+        return True
+
     @staticmethod
     def constrain_game_rig(game_rig_obj, ctrl_rig_obj):
         print(" Applying Game Rig Constraints ....")
+        loc_const_name = blender_auto_common.game_to_ctrl_constraint_pref + "Loc"
+        rot_const_name = blender_auto_common.game_to_ctrl_constraint_pref + "Rot"
+        const_names = (loc_const_name, rot_const_name)
         for bone in game_rig_obj.pose.bones:  # Pose Bones NOT Edit Bones
             print("Constraining: " + bone.name)
             keep_game_rig = bone.get("KEEP_GAME_RIG")  # note some bones have a pref attached
             cr_name = CreateGameRig.game_to_ctrl_rig_bone_name(bone.name, keep_game_rig)
-            loc_const_name = blender_auto_common.game_to_ctrl_constraint_pref + "Loc"
-            rot_const_name = blender_auto_common.game_to_ctrl_constraint_pref + "Rot"
-            loc_constrained = False
-            rot_constrained = False
-            for con in bone.constraints:  # remove all current constraints
-                if not loc_constrained and con.name == loc_const_name:
+            constrained = set()  # names of game rig constraints already on bone
+            for con in list(bone.constraints):  # remove all current constraints, copy since removing while iterating
+                if con.name in const_names and con.name not in constrained:
                     print("    Reenabling Constraint: " + con.name)
                     con.enabled = True
-                    loc_constrained = True
-                elif not rot_constrained and con.name == rot_const_name:
-                    print("    Reenabling Constraint: " + con.name)
-                    con.enabled = True
-                    rot_constrained = True
+                    if con.target is not ctrl_rig_obj or con.subtarget != cr_name:
+                        con.target = ctrl_rig_obj
+                        con.subtarget = cr_name
+                    constrained.add(con.name)
                 else:
                     print("    Removing Constraint: " + con.type + ": " + con.name)
                     bone.constraints.remove(con)
-            if not loc_constrained:
+            if loc_const_name not in constrained:
                 print("    Adding Constraint: " + loc_const_name)
-                loc = bone.constraints.new(type="COPY_LOCATION")
-                loc.name = loc_const_name
-                loc.target = ctrl_rig_obj
-                loc.subtarget = cr_name
-            if not rot_constrained:
+                blender_auto_common.add_bone_constraint(bone, "COPY_LOCATION", loc_const_name, ctrl_rig_obj, cr_name)
+            if rot_const_name not in constrained:
                 print("    Adding Constraint: " + rot_const_name)
-                rot = bone.constraints.new(type="COPY_ROTATION")
-                rot.name = rot_const_name
-                rot.target = ctrl_rig_obj
-                rot.subtarget = cr_name
+                blender_auto_common.add_bone_constraint(bone, "COPY_ROTATION", rot_const_name, ctrl_rig_obj, cr_name)
         print("Finished applying game rig constraints")
 
     def execute(self, context):
@@ -134,74 +193,91 @@ class CreateGameRig(bpy.types.Operator):
 
         # Get ref to ctrl and game rigs, create game rig if it doesn't exist, note there are two
         #     things needed the blender object and the blender armature
-        if context.scene.objects.find(self.ctrl_rig_name) < 0:  # Check if ctrl_rig exists
+        ctrl_rig_obj = context.scene.objects.get(self.ctrl_rig_name)
+        if ctrl_rig_obj is None:  # Check if ctrl_rig exists
             raise Exception("Could not find control rig: " + self.ctrl_rig_name)
-        ctrl_rig_obj = context.scene.objects[self.ctrl_rig_name]
         ctrl_rig_arm = ctrl_rig_obj.data
-        if context.scene.objects.find(self.game_rig_name) < 0:  # Check if game rig does not exist
+        game_rig_obj = context.scene.objects.get(self.game_rig_name)  # get ref if it does exist
+        if game_rig_obj is None:  # Check if game rig does not exist
             game_rig_arm = context.blend_data.armatures.new(self.game_rig_name)  # create if not
             game_rig_obj = context.blend_data.objects.new(self.game_rig_name, game_rig_arm)
         else:
-            game_rig_obj = context.scene.objects[self.game_rig_name]  # get ref if it does
             game_rig_arm = game_rig_obj.data
-        if context.blend_data.collections.find('Export') < 0:  # Check if 'Export' Collection does not exists
+        exp_col = context.blend_data.collections.get('Export')  # Grab ref if it does exist
+        if exp_col is None:  # Check if 'Export' Collection does not exists
             exp_col = context.blend_data.collections.new('Export')  # Create and link to current scene if not
             context.scene.collection.children.link(exp_col)
-        else:
-            exp_col = context.blend_data.collections['Export']  # Grab ref if it does
-        if context.blend_data.collections['Export'].objects.find(self.game_rig_name):  # Check if game rig in 'Rig'
+        if exp_col.objects.get(self.game_rig_name) is None:  # Check if game rig in 'Export'
             exp_col.objects.link(game_rig_obj)  # Link to collection if not
 
         # Select ctrl rig and make active -> switch it to edit mode -> itterate through
-        #     all root-level bones -> recursively itterate through children of those root-level bones
-        #     to get all ctrl rig edit bone data to copy to the game rig. Note, recursive itteration
+        #     all root-level bones -> depth first itterate through children of those root-level bones
+        #     to get all ctrl rig edit bone data to copy to the game rig. Note, heirarchy ordered itteration
         #     is necessary for parenting bones in the game rig, since the order of grabbing ctrl rig
         #     edit bone data is kept and used later when creating game rig edit bones (need to
         #     create parent bones before children to parent the children)
         #  TO DO: Make this able to run from any mode
+        # Read everything needed from the ctrl rig in this one edit session, so no need to switch
+        #     back to it later
+        keep_gr_props = {pb.name: pb.get("KEEP_GAME_RIG") for pb in ctrl_rig_obj.pose.bones}
         blender_auto_common.switch_to_mode(ctrl_rig_obj, 'EDIT', context=context)  # MODE SWTICH~~~
         bone_copier = EditBoneCopier()
-        for bone in ctrl_rig_arm.edit_bones:  # Important to pass edit_bones
-            if bone.parent is None:  # Check if root-level bone
-                blender_auto_common.traverse_bone_heirarchy(bone, bone_copier, 'copy_edit_bone_data')
+        bone_copier.read_bulk_edit_bone_data(ctrl_rig_arm.edit_bones)
+        # Important to pass edit_bones
+        blender_auto_common.traverse_armature_bones(ctrl_rig_arm.edit_bones, bone_copier, 'copy_edit_bone_data')
+        # Bones whose data hash matches the previous run for this game rig don't need to be rewritten
+        prev_hashes = {}
+        if not self.force_rebuild and self.cache_prop in game_rig_obj:
+            cache = json.loads(game_rig_obj[self.cache_prop])
+            if cache.get('ctrl_rig') == self.ctrl_rig_name:
+                prev_hashes = cache['bones']
+        bone_hashes = {}
 
         # Select game rig and make active, then switch to edit mode, then create bones from
-        #     previously copied ctrl rig edit bone data
-        bpy.ops.object.mode_set(mode='OBJECT')  # MODE SWTICH~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+        #     previously copied ctrl rig edit bone data (switch_to_mode leaves ctrl rig edit mode first)
         blender_auto_common.switch_to_mode(game_rig_obj, 'EDIT', context=context)  # MODE SWTICH~~~
         cr_to_gr_names = {}
         custom_name_gr_to_cr = {}
-        keep_bones = []
-        for (cb_name, cb_attrs) in bone_copier.ctrl_rig_attrs.items():
+        keep_bones = set()
+        ctrl_names = set(bone_copier.names)  # name lookups below are per bone, so use sets/dicts
+        gb_by_name = {b.name: b for b in game_rig_arm.edit_bones}
+        created = set()  # game rig bones created in this run
+        for cb_name in bone_copier.names:
             # Iter over all ctrl_rig edit bone attribute data copied
-            keep_game_rig = ctrl_rig_obj.pose.bones[cb_name].get("KEEP_GAME_RIG")  # custom prop to keep bone in gr
+            keep_game_rig = keep_gr_props.get(cb_name)  # custom prop to keep bone in gr
             gr_name = self.ctrl_to_game_rig_bone_name(cb_name, keep_game_rig)
             if gr_name:
-                keep_bones.append(gr_name)
-                if ctrl_rig_obj.pose.bones.find(gr_name) != -1:
+                keep_bones.add(gr_name)
+                if gr_name in ctrl_names:
                     raise Exception("Can't have identical game rig and ctrl rig bone name: " + gr_name)
             else:
                 gr_name = cb_name
             cr_to_gr_names[cb_name] = gr_name
             if keep_game_rig:
                 custom_name_gr_to_cr[gr_name] = cb_name
-            if game_rig_arm.edit_bones.find(gr_name) < 0:
+            bone_hashes[cb_name] = bone_copier.get_bone_data_hash(cb_name, gr_name,
+                                                                  cr_to_gr_names.get(bone_copier.parents[cb_name]))
+            game_bone = gb_by_name.get(gr_name)
+            cb_parent = bone_copier.parents[cb_name]
+            gr_parent = cr_to_gr_names[cb_parent] if cb_parent is not None else None
+            if game_bone is None:
                 # Check if game_rig edit bone by the same name does not exist and create if not
-                game_bone = game_rig_arm.edit_bones.new(gr_name)
-            else:  # if already exists grab a ref
-                game_bone = game_rig_arm.edit_bones[gr_name]
+                game_bone = gb_by_name[gr_name] = game_rig_arm.edit_bones.new(gr_name)
+                created.add(gr_name)
+            elif prev_hashes.get(cb_name) == bone_hashes[cb_name] and gr_parent not in created \
+                    and bone_copier.edit_bone_matches(game_bone, cb_name, gr_parent):
+                continue  # ctrl rig bone unchanged since last run and game rig bone still matches it
             # Even if game_rig edit bone already existed, ctrl_rig edit bone attribute data
             #     might have changed since script previously run, so overwriting all values
             game_bone.bbone_segments = 1
-            for (attr, val) in cb_attrs.items():
-                if attr == 'parent' and val is not None:  # if edit bone needs to be parented
-                    # Need to find game_rig edit bone with name corresponding to ctrl_rig edit
-                    #     bone's parent and use the ref to that bone to parent this bone
-                    gr_parent_name = cr_to_gr_names[val]
-                    parent_bone_ind = game_rig_arm.edit_bones.find(gr_parent_name)
-                    game_bone.parent = game_rig_arm.edit_bones[parent_bone_ind]
-                else:
-                    setattr(game_bone, attr, val)
+            if gr_parent is not None:  # if edit bone needs to be parented
+                # Need to find game_rig edit bone with name corresponding to ctrl_rig edit
+                #     bone's parent and use the ref to that bone to parent this bone
+                game_bone.parent = gb_by_name[gr_parent]
+            else:
+                game_bone.parent = None
+            for attr, vals in bone_copier.ctrl_rig_attrs.items():
+                setattr(game_bone, attr, vals[cb_name])
 
         # In Edit Mode, select all bones that are not Rigify Deform bones (prefixed with "DEF-")
         #     or are DEF- bones that don't exist in the ctrl_rig anymore and delete them
@@ -210,14 +286,29 @@ class CreateGameRig(bpy.types.Operator):
             if bone.name not in keep_bones:
                 bone.select = True
         bpy.ops.armature.delete()
+        # Only kept bones are left, so can now set head, tail, roll for all of them in one go
+        gr_to_cr_names = {gr_name: cb_name for cb_name, gr_name in cr_to_gr_names.items()}
+        bone_copier.write_bulk_edit_bone_data(game_rig_arm.edit_bones,
+                                              [gr_to_cr_names[b.name] for b in game_rig_arm.edit_bones])
         # Need to exit out of edit mode to save edit bones
         bpy.ops.object.mode_set(mode='OBJECT')  # MODE SWITCH ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+        game_rig_obj[self.cache_prop] = json.dumps({'ctrl_rig': self.ctrl_rig_name, 'bones': bone_hashes})
+
         # Add "KEEP_GAME_RIG custom prop to game_rig bones
         for gr_name, cr_name in custom_name_gr_to_cr.items():
             game_rig_obj.pose.bones[gr_name]["KEEP_GAME_RIG"] = cr_name
 
-        self.constrain_game_rig(game_rig_obj, ctrl_rig_obj)
+        # Constraints only depend on ctrl rig and game rig bone names, skip if those haven't changed and the
+        #     constraints are all still there and enabled (they can be disabled or deleted outside this operator)
+        constraint_fp = hashlib.md5(repr((ctrl_rig_obj.name, sorted(b.name for b in game_rig_obj.pose.bones),
+                                          sorted(custom_name_gr_to_cr.items()))).encode()).hexdigest()
+        if self.force_rebuild or game_rig_obj.get(self.constraint_fp_prop) != constraint_fp \
+                or not self.game_rig_constraints_intact(game_rig_obj, ctrl_rig_obj):
+            self.constrain_game_rig(game_rig_obj, ctrl_rig_obj)
+            game_rig_obj[self.constraint_fp_prop] = constraint_fp
+        else:
+            print("Game rig bones unchanged, skipping applying game rig constraints")
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -99,25 +99,27 @@ class CreateAnimRetargetingIntermediateRig(bpy.types.Operator):
         blender_auto_common.switch_to_mode(ctrl_rig_obj, "POSE", context=context)
         intermediate_rig_obj = context.blend_data.objects[intermediate_rig_name]
         ctrl_rig_obj = context.blend_data.objects[self.ctrl_rig_name]
+        loc_const_name = blender_auto_common.anim_retgt_intermediate_rig_constraint_pref + "Loc"
+        rot_const_name = blender_auto_common.anim_retgt_intermediate_rig_constraint_pref + "Rot"
+        retarget_bones = set(retgt_props.retarget_bones)
         for bone in ctrl_rig_obj.pose.bones:
-            if bone.name not in retgt_props.retarget_bones:
+            if bone.name not in retarget_bones:
                 continue
             print("Constraining: " + bone.name)
-            loc_const_name = blender_auto_common.anim_retgt_intermediate_rig_constraint_pref + "Loc"
-            rot_const_name = blender_auto_common.anim_retgt_intermediate_rig_constraint_pref + "Rot"
-            for con in bone.constraints:  # remove all current constraints
-                print("    Removing Constraint: " + con.type + ": " + con.name)
-                bone.constraints.remove(con)
-            print("    Adding Constraint: " + loc_const_name)
-            loc = bone.constraints.new(type="COPY_LOCATION")
-            loc.name = loc_const_name
-            loc.target = intermediate_rig_obj
-            loc.subtarget = bone.name
-            print("    Adding Constraint: " + rot_const_name)
-            rot = bone.constraints.new(type="COPY_ROTATION")
-            rot.name = rot_const_name
-            rot.target = intermediate_rig_obj
-            rot.subtarget = bone.name
+            # (type, subtarget): name of constraints bone needs, any matching ones already on bone are kept
+            needed = {("COPY_LOCATION", bone.name): loc_const_name, ("COPY_ROTATION", bone.name): rot_const_name}
+            for con in list(bone.constraints):  # remove all other current constraints
+                key = (con.type, getattr(con, 'subtarget', None))
+                if con.name == needed.get(key) and con.target is intermediate_rig_obj:
+                    print("    Keeping Constraint: " + con.name)
+                    con.enabled = True  # may have been disabled after a previous bake
+                    del needed[key]
+                else:
+                    print("    Removing Constraint: " + con.type + ": " + con.name)
+                    bone.constraints.remove(con)
+            for (con_type, subtarget), con_name in needed.items():
+                print("    Adding Constraint: " + con_name)
+                blender_auto_common.add_bone_constraint(bone, con_type, con_name, intermediate_rig_obj, subtarget)
         print("Finished applying game rig constraints")
         blender_auto_common.move_obj_to_coll(context, intermediate_rig_obj, "Extra")
         return {'FINISHED'}
@@ -191,9 +193,9 @@ class RetargetAnimsToRigify(bpy.types.Operator):
         dest_intermediate_rig_obj = None
         if len(self.dest_intermediate_rig_suff) > 0:
             dest_intermediate_rig = dest_rig_obj.name + self.dest_intermediate_rig_suff
-            if context.scene.objects.find(dest_intermediate_rig) < 0:
+            dest_intermediate_rig_obj = context.scene.objects.get(dest_intermediate_rig)
+            if dest_intermediate_rig_obj is None:
                 raise Exception("Could not find destination rigify intermediate rig " + dest_intermediate_rig)
-            dest_intermediate_rig_obj = context.scene.objects[dest_intermediate_rig]
         if self.use_rest_pose_asset:
             retgt_dist_obj_name = dest_intermediate_rig_obj.name if dest_intermediate_rig_obj else dest_rig_obj.name
             if context.blend_data.actions.find("__rest_" + retgt_dist_obj_name) < 0:
@@ -226,15 +228,15 @@ class RetargetAnimsToRigify(bpy.types.Operator):
 
     def check_if_retarget_anim_already_exists(self, context, source_anim_name, retgt_action_name):
         if len(self.dest_intermediate_rig_suff) > 0:
-            retgt_intermediate_action_ind = context.blend_data.actions.find(source_anim_name + " Retarget")
-            if retgt_intermediate_action_ind >= 0:
+            retgt_intermediate_action = context.blend_data.actions.get(source_anim_name + " Retarget")
+            if retgt_intermediate_action is not None:
                 print("    Overwriting retargeted anim on intermediate rig: " + source_anim_name + " Retarget")
-                context.blend_data.actions.remove(context.blend_data.actions[retgt_intermediate_action_ind])
-        retgt_action_ind = context.blend_data.actions.find(retgt_action_name)
-        if retgt_action_ind >= 0:
+                context.blend_data.actions.remove(retgt_intermediate_action)
+        retgt_action = context.blend_data.actions.get(retgt_action_name)
+        if retgt_action is not None:
             if self.overwrite:
                 print("    Overwrite: overwriting previously retarget anim on dest rig: " + retgt_action_name)
-                context.blend_data.actions.remove(context.blend_data.actions[retgt_action_ind])
+                context.blend_data.actions.remove(retgt_action)
             else:
                 print("    Overwrite: skipping retarget anim already defined: " + retgt_action_name)
                 return True
@@ -264,6 +266,7 @@ class RetargetAnimsToRigify(bpy.types.Operator):
         upper_fk = fk_bones[0]
         lower_fk = fk_bones[1]
         joint_tgt = limb_ik.parse_string_list(limb_ik.ctrl_bones)[1]
+        rest_cache = blender_auto_common.RestCache(dest_rig_obj)
         for fr in range(frame_start, frame_end + 1):
             context.scene.frame_set(fr)
             context.view_layer.update()
@@ -276,7 +279,7 @@ class RetargetAnimsToRigify(bpy.types.Operator):
             b = v1_v2.cross(n)
             joint_tgt_loc_as = dest_rig_obj.pose.bones[upper_fk].tail + b * 0.75
             blender_auto_common.set_bone_pose_armature_space(dest_rig_obj, joint_tgt,
-                 mathutils.Matrix.LocRotScale(joint_tgt_loc_as, None, None))
+                 mathutils.Matrix.LocRotScale(joint_tgt_loc_as, None, None), rest_cache)
             context.view_layer.update()
             dest_rig_obj.pose.bones[joint_tgt].keyframe_insert('location')
 
@@ -1,14 +1,27 @@
 import bpy
 import ast
+import functools
 import mathutils
 import math
-from collections import OrderedDict
+import numpy as np
+
+try:
+    import numba  # not bundled with blender, so everything using jit() needs to work without it
+except ImportError:
+    numba = None
 
 
 game_to_ctrl_constraint_pref = "CtrlRigConst_"
 anim_retgt_intermediate_rig_constraint_pref = "CtrlRigIntermedConst_"
 
 
+def jit(fn):
+    """Decorator that compiles 'fn' with numba.njit if numba is installed, otherwise returns 'fn' unchanged"""
+    if numba is None:
+        return fn
+    return numba.njit(cache=True)(fn)
+
+
 class RigifyLimbIKBakeSettings:
     def __init__(self, prop_bone='', fk_bones='[]', ik_bones='[]', ctrl_bones='[]', tail_bones='[]', extra_ctrls='[]'):
         self.prop_bone = prop_bone
@@ -17,21 +30,30 @@ class RigifyLimbIKBakeSettings:
         self.ctrl_bones = ctrl_bones
         self.tail_bones = tail_bones
         self.extra_ctrls = extra_ctrls
+        self._flat_list_key = None  # bone settings the cached flat list was built from
+        self._flat_list = ()
 
     def get_bone_flat_list(self):
-        out_list = []
-        out_list += [self.prop_bone]
-        out_list += self.parse_string_list(self.fk_bones)
-        out_list += self.parse_string_list(self.ik_bones)
-        out_list += self.parse_string_list(self.ctrl_bones)
-        out_list += self.parse_string_list(self.tail_bones)
-        out_list += self.parse_string_list(self.extra_ctrls)
-        return out_list
+        # Flat list is rebuilt only if any of the bone settings were changed since last call
+        key = (self.prop_bone, self.fk_bones, self.ik_bones, self.ctrl_bones, self.tail_bones, self.extra_ctrls)
+        if key != self._flat_list_key:
+            parse = self._parse_string_list_cached
+            self._flat_list = (self.prop_bone, *parse(self.fk_bones), *parse(self.ik_bones), *parse(self.ctrl_bones),
+                               *parse(self.tail_bones), *parse(self.extra_ctrls))
+            self._flat_list_key = key
+        return list(self._flat_list)
 
     @staticmethod
     def parse_string_list(parse_str):
+        return list(RigifyLimbIKBakeSettings._parse_string_list_cached(parse_str))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _parse_string_list_cached(parse_str):
+        # literal_eval is slow, bone list strings are parsed at most once, stored as tuple so cached value
+        #     can't be changed by callers
         try:
-            return ast.literal_eval(parse_str)
+            return tuple(ast.literal_eval(parse_str))
         except SyntaxError as se:
             raise Exception("Could not parse limb IK bake setting bone list") from se
 
@@ -40,15 +62,21 @@ def switch_to_mode(obj, mode, context=None):
     """Switches obj to mode given by 'mode'.
 
     NOTE: Will deselect any currently selected and/or activated objects and leave
-    object selected and activated"""
-    bpy.ops.object.mode_set(mode='OBJECT')  # first switch to obj mode
-    bpy.ops.object.select_all(action='DESELECT')  # so we can deselect all
+    object selected and activated. Does nothing if that's already the case and obj is already
+    in 'mode', since even a no-op mode_set triggers a depsgraph update"""
+    view_layer = context.view_layer if context else bpy.context.view_layer
+    if view_layer.objects.active is obj and obj.mode == mode and obj.select_get() \
+            and len(view_layer.objects.selected) == 1:
+        return
+    active = view_layer.objects.active
+    if active is not None and active.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')  # first switch to obj mode
+    for sel_obj in list(view_layer.objects.selected):  # so we can deselect all, cheaper than select_all op
+        sel_obj.select_set(False)
     obj.select_set(True)  # Need to select AND activate obj to switch modes
-    if context:
-        context.view_layer.objects.active = obj
-    else:
-        bpy.context.view_layer.objects.active = obj
-    bpy.ops.object.mode_set(mode=mode)
+    view_layer.objects.active = obj
+    if mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode=mode)
 
 
 def find_object_in_mode(mode, raise_if_missing=True, context=None):
@@ -73,9 +101,8 @@ def get_export_armature():
     """ Get first armature that is in a collection called 'Export' or None if one not found.
 
     This is useful for getting the send2ue armature that contains all the unreal export animations"""
-    try:
-        export_col = bpy.data.collections['Export']
-    except KeyError:
+    export_col = bpy.data.collections.get('Export')
+    if export_col is None:
         return None
     for obj in export_col.objects:
         if obj.type == 'ARMATURE':
@@ -109,29 +136,100 @@ def toggle_rig_constraints(enable, constrain_rig, pref_identifier, bone_names=No
     constraints in bones and enable or disable game rig to control rig loc/rot constraints. This method does not
     add or remove any constraints, and will not disable/enable any other constraints besides the ones identified
     by pref_identifier."""
-    for bone in constrain_rig.pose.bones:
-        if bone_names:
-            if bone.name not in bone_names:
-                continue
+    pose_bones = constrain_rig.pose.bones
+    if bone_names:
+        bones = [pose_bones.get(name) for name in frozenset(bone_names)]  # look up only the needed bones
+    else:
+        bones = pose_bones
+    for bone in bones:
+        if bone is None:
+            continue
         for cnst in bone.constraints:
-            if cnst.name[:len(pref_identifier)] == pref_identifier:
+            # Only write if changed, every write to enabled tags the depsgraph for an update
+            if cnst.enabled != enable and cnst.name.startswith(pref_identifier):
                 cnst.enabled = enable
 
 
+def add_bone_constraint(bone, con_type, name, target, subtarget):
+    """Add constraint of type 'con_type' (e.g. 'COPY_LOCATION') named 'name' to pose bone 'bone' that targets
+    bone 'subtarget' in armature object 'target', returns the new constraint"""
+    con = bone.constraints.new(type=con_type)
+    con.name = name
+    con.target = target
+    con.subtarget = subtarget
+    return con
+
+
+def _flatten_bone_heirarchies(root_bones):
+    """Return list of all bones under 'root_bones' (roots included) depth first, parents always before children"""
+    stack = list(reversed(root_bones))
+    flat = []
+    while stack:
+        b = stack.pop()
+        flat.append(b)
+        stack.extend(reversed(b.children))  # reversed so children are visited in their original order
+    return flat
+
+
 def traverse_bone_heirarchy(bn, operator, method):
-    """Recursively tranverse a bone heirarchy and perform operation on each bone.
+    """Tranverse a bone heirarchy depth first and perform operation on each bone.
 
-        Should pass in root bones as 'bn', function will recursively call itself on
-        all child bones. 'operator' is any object that has a method named 'method' to
-        call on every bone recursively"""
-    getattr(operator, method)(bn)
-    for ch in bn.children:
-        traverse_bone_heirarchy(ch, operator, method)
+        Should pass in root bones as 'bn', function will walk all child bones, parents are always
+        visited before their children. 'operator' is any object that has a method named 'method' to
+        call on every bone. Uses an explicit stack instead of recursion so deep rigs can't hit the
+        python recursion limit, and collects the bones before calling 'method' on them in a tight loop"""
+    fn = getattr(operator, method)
+    for b in _flatten_bone_heirarchies([bn]):
+        fn(b)
 
-def set_bone_pose_armature_space(armature_obj, bone_name, bone_pose_as):
-    """set bone_name bone pose in armature_obj to armature space pose matrix specified in bone_pose_as"""
-    b = armature_obj.data.bones[bone_name]
+
+def traverse_armature_bones(bones, operator=None, method=None):
+    """Tranverse all bone heirarchies in an armature depth first and return a flat list of the bones in that order.
+
+        'bones' is a bone collection of an armature (e.g. edit_bones, bones, pose.bones), every root bone
+        in it is walked in collection order with parents always before their children. If 'operator' is
+        given, will call its method named 'method' on every bone in that order"""
+    flat = _flatten_bone_heirarchies([b for b in bones if b.parent is None])
+    if operator is not None:
+        fn = getattr(operator, method)
+        for b in flat:
+            fn(b)
+    return flat
+
+
+class RestCache:
+    """Rest pose data of armature bones for repeatedly converting armature space poses to bone local poses.
+
+    For each bone, stores inverse of its rest matrix relative to its parent (matrix_local inverted for root bones),
+    so the conversion is a single matmul chain. Only bones that fully inherit their parent transform (and use
+    local location) are cached, other bones need convert_local_to_pose. Needs to be rebuilt if rest pose changes"""
+    def __init__(self, armature_obj):
+        self.inv_rel_rest = {}
+        for b in armature_obj.data.bones:
+            if not b.use_inherit_rotation or b.inherit_scale != 'FULL' or not b.use_local_location:
+                continue
+            if b.parent is not None:
+                self.inv_rel_rest[b.name] = b.matrix_local.inverted() @ b.parent.matrix_local
+            else:
+                self.inv_rel_rest[b.name] = b.matrix_local.inverted()
+
+
+def set_bone_pose_armature_space(armature_obj, bone_name, bone_pose_as, rest_cache=None):
+    """set bone_name bone pose in armature_obj to armature space pose matrix specified in bone_pose_as
+
+    Pass a RestCache of armature_obj as 'rest_cache' when calling this repeatedly, e.g. every frame"""
     pb = armature_obj.pose.bones[bone_name]
+    inv_rel_rest = rest_cache.inv_rel_rest.get(bone_name) if rest_cache is not None else None
+    if inv_rel_rest is not None:
+        if pb.parent is not None:
+            bone_pose_ls = inv_rel_rest @ pb.parent.matrix.inverted() @ bone_pose_as
+        else:
+            bone_pose_ls = inv_rel_rest @ bone_pose_as
+        pb.location = bone_pose_ls.to_translation()
+        pb.rotation_quaternion = bone_pose_ls.to_quaternion()
+        pb.scale = bone_pose_ls.to_scale()
+        return
+    b = armature_obj.data.bones[bone_name]
     bone_rest_as = b.matrix_local
     if b.parent is not None:
         parent_pose_as = pb.parent.matrix
@@ -145,19 +243,372 @@ def set_bone_pose_armature_space(armature_obj, bone_name, bone_pose_as):
     pb.scale = bone_pose_ls.to_scale()
 
 
-def get_fcurve_keyframe_at_frame(frame, fcurve):
-    for i, kf in enumerate(fcurve.keyframe_points):
-        if math.isclose(kf.co[0], float(frame)):
-            return i, kf
-    return -1, None
+def _ik_chain_bone_names(rig_obj):
+    """Return set of names of pose bones in rig_obj that are moved by an IK or SPLINE_IK constraint chain"""
+    names = set()
+    for pb in rig_obj.pose.bones:
+        for con in pb.constraints:
+            if con.type not in ('IK', 'SPLINE_IK') or not con.enabled:
+                continue
+            chain = [pb] + list(pb.parent_recursive)
+            if con.chain_count > 0:
+                chain = chain[:con.chain_count]
+            names.update(chain_pb.name for chain_pb in chain)
+    return names
 
-def scale_fcurve_from_midpoint(fcurve, scale_factor):
-    curve_min = math.inf
-    curve_max = -math.inf
-    for kf in fcurve.keyframe_points:
-        if kf.co[1] > curve_max: curve_max = kf.co[1]
-        if kf.co[1] < curve_min: curve_min = kf.co[1]
-    curve_mid = (curve_max + curve_min) / 2.
-    for kf in fcurve.keyframe_points:
-        kf.co[1] += (kf.co[1] - curve_mid) * (scale_factor - 1.)
 
+def _pose_bone_parents_static(rig_obj, pb, act, ik_bone_names=None):
+    """Return True if parents of pb have no constraints or drivers, aren't in an IK chain and aren't animated by
+    act or NLA tracks"""
+    anim_data = rig_obj.animation_data
+    if anim_data is not None and any(not track.mute for track in anim_data.nla_tracks):
+        return False
+    if ik_bone_names is None:
+        ik_bone_names = _ik_chain_bone_names(rig_obj)
+    driven_paths = [fc.data_path for fc in anim_data.drivers] if anim_data is not None else []
+    act_paths = [fc.data_path for fc in act.fcurves]
+    for parent_pb in pb.parent_recursive:
+        if len(parent_pb.constraints) or parent_pb.name in ik_bone_names:
+            return False
+        path_pref = 'pose.bones["%s"].' % parent_pb.name
+        if any(p.startswith(path_pref) for p in driven_paths) or any(p.startswith(path_pref) for p in act_paths):
+            return False
+    return True
+
+
+def _sampleable_pose_bones(rig_obj, act, bone_names):
+    """Return pose bones of bone_names whose pose only depends on their own act fcurves and rest pose.
+
+    That is, act is the active action evaluated with full influence, REPLACE blending and HOLD extrapolation, no
+    unmuted NLA tracks, none of the bone fcurves (or their groups) are muted, bone and its parents have no
+    constraints or drivers and aren't in an IK chain, and parents aren't animated by act. Everything else would
+    make evaluating act fcurves directly differ from frame_set."""
+    anim_data = rig_obj.animation_data
+    if anim_data is None or anim_data.action is not act or anim_data.action_influence != 1. \
+            or anim_data.action_blend_type != 'REPLACE' or anim_data.action_extrapolation != 'HOLD' \
+            or any(not track.mute for track in anim_data.nla_tracks):
+        return []
+    driven_paths = [fc.data_path for fc in anim_data.drivers]
+    muted_paths = [fc.data_path for fc in act.fcurves if fc.mute or (fc.group is not None and fc.group.mute)]
+    ik_bone_names = _ik_chain_bone_names(rig_obj)
+    pose_bones = []
+    for bone_name in bone_names:
+        pb = rig_obj.pose.bones.get(bone_name)
+        if pb is None or len(pb.constraints) or bone_name in ik_bone_names:
+            continue
+        path_pref = 'pose.bones["%s"].' % bone_name
+        if any(p.startswith(path_pref) for p in driven_paths) or any(p.startswith(path_pref) for p in muted_paths) \
+                or not _pose_bone_parents_static(rig_obj, pb, act, ik_bone_names):
+            continue
+        pose_bones.append(pb)
+    return pose_bones
+
+
+def _sample_fcurve_channel(act, pb, prop, index, frames):
+    """Return numpy array of pb 'prop'[index] values at frames evaluated from act fcurve, or current value if the
+    channel isn't animated"""
+    fc = act.fcurves.find('pose.bones["%s"].%s' % (pb.name, prop), index=index)
+    if fc is None:
+        return np.full(len(frames), getattr(pb, prop)[index])
+    return np.fromiter((fc.evaluate(fr) for fr in frames), dtype=np.float64, count=len(frames))
+
+
+def sample_pose_bone_matrices(rig_obj, act, bone_names, frames):
+    """Return armature space pose matrices of bones at frames by evaluating act fcurves directly, without frame_set.
+
+    Only possible for bones using quaternion rotation that pass _sampleable_pose_bones (act is the active action
+    evaluated as is, no NLA, muted fcurves, constraints, drivers or IK chains affecting the bone or its parents and
+    parents not animated by act), since none of that gets evaluated here. Bones that can't be sampled are left out
+    of the returned dict, caller needs to step through the frames with frame_set for those. Transform channels not animated by act keep the pose bone current
+    values, same as they would with frame_set.
+
+    :return: dict of bone name to list of pose matrices, one per frame, for the bones that could be sampled
+    """
+    frames = [float(fr) for fr in frames]
+    out = {}
+    for pb in _sampleable_pose_bones(rig_obj, act, bone_names):
+        if pb.rotation_mode != 'QUATERNION':
+            continue
+        # (frames, 10) array of loc xyz, quat wxyz, scale xyz
+        basis_vals = np.column_stack([_sample_fcurve_channel(act, pb, prop, i, frames)
+                                      for prop, size in (('location', 3), ('rotation_quaternion', 4), ('scale', 3))
+                                      for i in range(size)])
+        b = pb.bone
+        if b.parent is not None:
+            parent_kwargs = {'parent_matrix': pb.parent.matrix.copy(), 'parent_matrix_local': b.parent.matrix_local}
+        else:
+            parent_kwargs = {}
+        mats = []
+        for vals in basis_vals:
+            basis = mathutils.Matrix.LocRotScale(vals[0:3], mathutils.Quaternion(vals[3:7]).normalized(), vals[7:10])
+            mats.append(b.convert_local_to_pose(basis, b.matrix_local, **parent_kwargs))
+        out[pb.name] = mats
+    return out
+
+
+def sample_pose_bone_locations(rig_obj, act, bone_names, frames):
+    """Return armature space pose locations of bones at frames by evaluating act location fcurves directly.
+
+    Like sample_pose_bone_matrices but only for the bone head location, which only depends on the location
+    channels, so it's worked out for all frames at once with numpy. Bones also need to fully inherit their parent
+    transform and use local location. Bones that can't be sampled are left out of the returned dict.
+
+    :return: dict of bone name to (frames, 3) numpy array of locations, for the bones that could be sampled
+    """
+    frames = [float(fr) for fr in frames]
+    out = {}
+    for pb in _sampleable_pose_bones(rig_obj, act, bone_names):
+        b = pb.bone
+        if not b.use_inherit_rotation or b.inherit_scale != 'FULL' or not b.use_local_location:
+            continue
+        # pose = parent pose @ rest relative to parent @ basis, and translation of basis is just the location
+        if b.parent is not None:
+            rest_to_pose = np.array(pb.parent.matrix @ b.parent.matrix_local.inverted() @ b.matrix_local)
+        else:
+            rest_to_pose = np.array(b.matrix_local)
+        locs = np.column_stack([_sample_fcurve_channel(act, pb, 'location', i, frames) for i in range(3)])
+        out[pb.name] = locs @ rest_to_pose[:3, :3].T + rest_to_pose[:3, 3]
+    return out
+
+
+def sample_pose_bone_parent_matrices(rig_obj, act, bone_names, frames):
+    """Return dict of bone name: (frames, 4, 4) numpy array of the bone parent armature space pose at frames.
+
+    Value is None for bones without a parent. Parents that are static (see _pose_bone_parents_static) just use
+    their current pose, the rest are read while stepping through frames with frame_set, once for all bones.
+    act must be the rig_obj active action."""
+    parent_mats = {}
+    frame_set_bones = []
+    for bone_name in bone_names:
+        pb = rig_obj.pose.bones[bone_name]
+        if pb.parent is None:
+            parent_mats[bone_name] = None
+        elif _pose_bone_parents_static(rig_obj, pb, act):
+            parent_mats[bone_name] = np.broadcast_to(np.array(pb.parent.matrix), (len(frames), 4, 4))
+        else:
+            parent_mats[bone_name] = np.empty((len(frames), 4, 4))
+            frame_set_bones.append((parent_mats[bone_name], pb.parent))
+    if frame_set_bones:
+        frame_set = bpy.context.scene.frame_set
+        for k, fr in enumerate(frames):
+            frame_set(fr)
+            for mats, parent_pb in frame_set_bones:
+                mats[k] = parent_pb.matrix
+    return parent_mats
+
+
+def key_pose_bone_matrices(rig_obj, act, bone_name, frames, mats, parent_mats=None):
+    """Key location and rotation_quaternion of bone so that its armature space pose matrix is mats at frames.
+
+    'mats' is a (frames, 4, 4) numpy array. Keyframe values are all computed first and then written to act fcurves
+    in one go with add_fcurve_keyframes, instead of setting the pose bone matrix and calling keyframe_insert every
+    frame. 'parent_mats' is the bone entry of sample_pose_bone_parent_matrices, pass it when keying several bones
+    so the frames are only stepped through once, otherwise it's sampled here. act must be the rig_obj active action.
+    """
+    pb = rig_obj.pose.bones[bone_name]
+    b = pb.bone
+    n_frames = len(mats)
+    if parent_mats is None and b.parent is not None:
+        parent_mats = sample_pose_bone_parent_matrices(rig_obj, act, [bone_name], frames)[bone_name]
+    # (frames, 8) array of frame, loc xyz, quat wxyz
+    co_vals = np.empty((n_frames, 8))
+    co_vals[:, 0] = frames
+    if b.use_inherit_rotation and b.inherit_scale == 'FULL' and b.use_local_location:
+        # pose = parent pose @ rest relative to parent @ basis, so basis for all frames with matmuls
+        if parent_mats is not None:
+            rest_to_pose = parent_mats @ np.array(b.parent.matrix_local.inverted() @ b.matrix_local)
+        else:
+            rest_to_pose = np.array(b.matrix_local)
+        basis = np.linalg.inv(rest_to_pose) @ mats
+        co_vals[:, 1:4] = basis[:, :3, 3]
+        co_vals[:, 4:8] = matrices_to_quats(basis[:, :3, :3])
+    else:
+        for k, mat in enumerate(mats):
+            if parent_mats is not None:
+                parent_kwargs = {'parent_matrix': mathutils.Matrix(parent_mats[k].tolist()),
+                                 'parent_matrix_local': b.parent.matrix_local}
+            else:
+                parent_kwargs = {}
+            basis = b.convert_local_to_pose(mathutils.Matrix(mat.tolist()), b.matrix_local, invert=True,
+                                            **parent_kwargs)
+            co_vals[k, 1:4] = basis.to_translation()
+            co_vals[k, 4:8] = basis.to_quaternion()
+    path_pref = 'pose.bones["%s"].' % bone_name
+    chans = [('location', i) for i in range(3)] + [('rotation_quaternion', i) for i in range(4)]
+    for col, (prop, i) in enumerate(chans, start=1):
+        fc = act.fcurves.find(path_pref + prop, index=i)
+        if fc is None:
+            fc = act.fcurves.new(path_pref + prop, index=i, action_group=bone_name)
+        add_fcurve_keyframes(fc, co_vals[:, [0, col]])
+
+
+def add_fcurve_keyframes(fcurve, co):
+    """Add keyframes at (N, 2) array of frame, value 'co' to fcurve in one go.
+
+    Like keyframe_insert, replaces existing keyframes on (nearly) the same frames. New keyframes are appended with
+    add() and all keyframe co's written with a single foreach_set, update() then sorts keyframes by frame and
+    recalculates handles."""
+    co = np.asarray(co, dtype=np.float32)
+    kps = fcurve.keyframe_points
+    if len(kps):
+        old_frames = get_keyframe_data(fcurve)[:, 0]
+        new_frames = np.sort(co[:, 0])
+        # closest new frame to each existing keyframe, same threshold blender uses when inserting keyframes
+        i = np.clip(np.searchsorted(new_frames, old_frames), 1, max(len(new_frames) - 1, 1))
+        hi = new_frames[np.minimum(i, len(new_frames) - 1)]
+        replaced = np.minimum(np.abs(old_frames - new_frames[i - 1]), np.abs(old_frames - hi)) < 0.01
+        if replaced.any():
+            keep_fcurve_keyframes(fcurve, np.flatnonzero(~replaced))
+    n_old = len(kps)
+    kps.add(len(co))
+    all_co = get_keyframe_data(fcurve)
+    all_co[n_old:] = co
+    kps.foreach_set('co', all_co.ravel())
+    fcurve.update()
+
+
+def loc_quats_to_matrices(locs, quats):
+    """Return (N, 4, 4) numpy array of transform matrices from (N, 3) locations and (N, 4) wxyz quaternions, same as
+    mathutils Matrix.LocRotScale(loc, quat, None) for each"""
+    w, x, y, z = (np.asarray(quats, dtype=np.float64) / np.linalg.norm(quats, axis=-1, keepdims=True)).T
+    mats = np.zeros((len(w), 4, 4))
+    mats[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    mats[:, 0, 1] = 2 * (x * y - w * z)
+    mats[:, 0, 2] = 2 * (x * z + w * y)
+    mats[:, 1, 0] = 2 * (x * y + w * z)
+    mats[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    mats[:, 1, 2] = 2 * (y * z - w * x)
+    mats[:, 2, 0] = 2 * (x * z - w * y)
+    mats[:, 2, 1] = 2 * (y * z + w * x)
+    mats[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    mats[:, :3, 3] = locs
+    mats[:, 3, 3] = 1
+    return mats
+
+
+def matrices_to_quats(mats):
+    """Return (N, 4) numpy array of wxyz quaternions of (N, 3, 3) rotation matrices (scale is normalized out), with
+    w >= 0 like mathutils Matrix.to_quaternion"""
+    mats = np.asarray(mats, dtype=np.float64)
+    mats = mats / np.linalg.norm(mats, axis=1, keepdims=True)  # normalize columns
+    m00, m01, m02 = mats[:, 0, 0], mats[:, 0, 1], mats[:, 0, 2]
+    m10, m11, m12 = mats[:, 1, 0], mats[:, 1, 1], mats[:, 1, 2]
+    m20, m21, m22 = mats[:, 2, 0], mats[:, 2, 1], mats[:, 2, 2]
+    trace = m00 + m11 + m22
+    # Pick the numerically stable formula per matrix based on largest of trace and diagonal
+    case = np.argmax(np.stack([trace, m00, m11, m22], axis=-1), axis=-1)
+    s = 2 * np.sqrt(np.maximum(1 + np.choose(case, [trace, m00 - m11 - m22, m11 - m00 - m22, m22 - m00 - m11]), 1e-12))
+    quats = np.empty((len(mats), 4))
+    quats[:, 0] = np.choose(case, [s / 4, (m21 - m12) / s, (m02 - m20) / s, (m10 - m01) / s])
+    quats[:, 1] = np.choose(case, [(m21 - m12) / s, s / 4, (m01 + m10) / s, (m02 + m20) / s])
+    quats[:, 2] = np.choose(case, [(m02 - m20) / s, (m01 + m10) / s, s / 4, (m12 + m21) / s])
+    quats[:, 3] = np.choose(case, [(m10 - m01) / s, (m02 + m20) / s, (m12 + m21) / s, s / 4])
+    quats[quats[:, 0] < 0] *= -1
+    return quats / np.linalg.norm(quats, axis=-1, keepdims=True)
+
+
+@jit
+def compute_foot_speeds(x_up, x_down, y_up, y_down, up_frame, down_frame, fps, frame_len):
+    """Return (x_delta, y_delta, t_delta, x_speed, y_speed, speed_mag) of a foot that is on the ground from
+    down_frame to up_frame with x and y location given at those frames. frame_len is action frame range length,
+    used if foot is down across the end of the action"""
+    x_delta = x_up - x_down
+    y_delta = y_up - y_down
+    t_delta = up_frame - down_frame
+    if down_frame > up_frame:
+        t_delta += frame_len  # plus b/c last frame needs to wrap to first
+    t_delta *= 1. / fps
+    x_speed = x_delta / t_delta
+    y_speed = y_delta / t_delta
+    return x_delta, y_delta, t_delta, x_speed, y_speed, math.sqrt(x_speed ** 2 + y_speed ** 2)
+
+
+def slerp_np(q0, q1, t):
+    """Spherical linear interpolation between arrays of quaternions q0 and q1 (shape (N, 4)) by factor t (scalar
+    or (N,) array).
+
+    Same as mathutils Quaternion.slerp but for all N quaternions at once, takes shortest path and falls back to
+    linear interpolation when quaternions are nearly the same."""
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    dot = (q0 * q1).sum(axis=-1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)  # shortest path
+    dot = np.abs(dot)
+    omega = np.arccos(np.clip(dot, 0, 1))
+    sin_omega = np.sin(omega)
+    near = dot > 1 - 1e-4
+    sin_omega[near] = 1  # avoid divide by zero, lerp is used for these
+    s0 = np.where(near, 1 - t, np.sin((1 - t) * omega) / sin_omega)
+    s1 = np.where(near, t, np.sin(t * omega) / sin_omega)
+    return s0[:, None] * q0 + s1[:, None] * q1
+
+
+def get_keyframe_data(fcurve, prop='co'):
+    """Return (N, 2) numpy array of keyframe 'prop' ('co', 'handle_left' or 'handle_right') for all N keyframes
+    in fcurve, read in one go with foreach_get"""
+    kps = fcurve.keyframe_points
+    buf = np.empty(2 * len(kps), dtype=np.float32)
+    kps.foreach_get(prop, buf)
+    return buf.reshape(-1, 2)
+
+
+def values_at_keyframes(fcurve, frames):
+    """Return list of fcurve keyframe values at each of 'frames' (None where there isn't a keyframe).
+
+    Keyframes are read once with get_keyframe_data and all frames are looked up with one vectorized binary search"""
+    co = get_keyframe_data(fcurve).astype(np.float64)
+    query = np.asarray(frames, dtype=np.float64)
+    n = len(co)
+    if n == 0:
+        return [None] * len(query)
+    kf_frames = co[:, 0]
+    i = np.clip(np.searchsorted(kf_frames, query, side='right') - 1, 0, n - 1)
+    out = [None] * len(query)
+    for inds in (np.minimum(i + 1, n - 1), i):  # a close enough keyframe can be just after frame, i wins if both
+        # same tolerance as math.isclose
+        close = np.abs(kf_frames[inds] - query) <= 1e-9 * np.maximum(np.abs(kf_frames[inds]), np.abs(query))
+        for q in np.flatnonzero(close):
+            out[q] = float(co[inds[q], 1])
+    return out
+
+
+def keep_fcurve_keyframes(fcurve, keep_inds, edit_kept=None):
+    """Remove all keyframes in fcurve except the ones at indices in 'keep_inds'.
+
+    Rebuilds the curve with clear()/add()/foreach_set instead of removing keyframes one at a time (each remove
+    shifts the rest of the keyframes). Interpolation, handle types, easing and keyframe type can't be bulk set, so
+    those are copied one keyframe at a time, only for kept keyframes. 'edit_kept' is an optional function that is
+    called with a dict of the kept keyframes 'co', 'handle_left' and 'handle_right' (K, 2) arrays, and can change
+    them in place before they are written back, so kept keyframes can be moved without more RNA writes"""
+    kps = fcurve.keyframe_points
+    keep_inds = list(keep_inds)
+    if keep_inds == list(range(len(kps))) and edit_kept is None:
+        return  # nothing to remove, e.g. fcurve with only a safety keyframe
+    enum_attrs = ('interpolation', 'handle_left_type', 'handle_right_type', 'easing', 'type')
+    enum_vals = [[getattr(kps[i], at) for at in enum_attrs] for i in keep_inds]
+    kept_data = {prop: get_keyframe_data(fcurve, prop)[keep_inds] for prop in ('co', 'handle_left', 'handle_right')}
+    if edit_kept is not None:
+        edit_kept(kept_data)
+    kps.clear()
+    if keep_inds:
+        kps.add(len(keep_inds))
+        for prop, arr in kept_data.items():
+            kps.foreach_set(prop, arr.ravel())
+        for kp, vals in zip(kps, enum_vals):
+            for at, val in zip(enum_attrs, vals):
+                setattr(kp, at, val)
+    fcurve.update()
+
+
+def scale_fcurve_from_midpoint(fcurve, scale_factor):
+    """Scale fcurve values (keyframes and their handles) by 'scale_factor' about the midpoint of its value range"""
+    kps = fcurve.keyframe_points
+    if len(kps) == 0:
+        return
+    co = get_keyframe_data(fcurve)
+    curve_mid = 0.5 * (co[:, 1].max() + co[:, 1].min())
+    for prop in ('co', 'handle_left', 'handle_right'):  # scale handles too so interpolation keeps its shape
+        data = co if prop == 'co' else get_keyframe_data(fcurve, prop)
+        data[:, 1] += (data[:, 1] - curve_mid) * (scale_factor - 1.)
+        kps.foreach_set(prop, data.ravel())
+    fcurve.update()
@@ -1,6 +1,6 @@
 import bpy
 import math
-import mathutils
+import numpy as np
 import warnings
 import sys
 import os
@@ -27,69 +27,83 @@ def create_idle_poses_from_anim(anim_name, pose_frame, app_name, prefix=True, le
     :param push_down: push down animations into NLA track
     """
 
+    def move_kf_to_frame_1(kf_data):
+        # same as setting co_ui.x (handles move with keyframe), then flattening handles
+        shift = 1.0 - kf_data['co'][:, 0]
+        for prop in ('handle_left', 'handle_right'):
+            kf_data[prop][:, 0] += shift
+            kf_data[prop][:, 1] = kf_data['co'][:, 1]
+        kf_data['co'][:, 0] = 1.0
+
     rig_obj = blender_auto_common.find_object_in_mode('POSE')  # Get current pose mode rig0
     rig_obj.animation_data.action = None  # unlink any actions currently in dope sheet
 
-    for action in bpy.data.actions:
-        #  Find the animation to create the idle pose from either thru prefix or full name match
-        if prefix:
-            if action.name[:len(anim_name)] != anim_name:
-                continue
-        else:
-            if action.name != anim_name:
-                continue
+    #  Find the animations to create the idle pose from either thru prefix or full name match. Collected before
+    #      copying, so the idle actions added below aren't matched again
+    actions = bpy.data.actions
+    if prefix:
+        src_actions = [action for action in actions if action.name.startswith(anim_name)]
+    else:
+        action = actions.get(anim_name)
+        src_actions = [action] if action is not None else []
+    grip_prefix = 'pose.bones["grip"]'
+    grip_rot_path = grip_prefix + '.rotation_quaternion'
+    for action in src_actions:
         ac = action.copy()  # Copy that animation, this will be the idle action
         ac.name = action.name + app_name
         # Adjusting keyframes so that we preserve the safety keyframes (all keyframes set at Fram 1)
         #     then finding all keyframes on 'pose_frame' and moving them over to frame 1, overwriting
-        #     the safety keyframes on those channels that have keyframes on 'pose_frame'
-        for fcurve in ac.fcurves:
-            kf_to_move_ind = -1
-            for i, kf in enumerate(fcurve.keyframe_points):  # Finding keyframes at 'pose_frame'
-                if math.isclose(kf.co.x, pose_frame, abs_tol=0.1):
-                    kf_to_move_ind = i
-                    break  # find first one that is close enough
-            if kf_to_move_ind >= 0:
-                # if found a keyframe on 'pose_frame', deleting all other keyframes on channel
-                for i in range(0, len(fcurve.keyframe_points))[::-1]:
-                    # itterating backwards to since we're deleting things in the collection,
-                    #     so need to pop the last items first
-                    if i == kf_to_move_ind:
-                        continue
-                    fcurve.keyframe_points.remove(fcurve.keyframe_points[i])
-                # Moving that keyframe on 'pose_frame' to Frame 1 and making control handles
-                # even so there isn't any unwanted movement
-                fcurve.keyframe_points[0].co_ui.x = 1.0
-                fcurve.keyframe_points[0].handle_left.y = fcurve.keyframe_points[0].co.y
-                fcurve.keyframe_points[0].handle_right.y = fcurve.keyframe_points[0].co.y
+        #     the safety keyframes on those channels that have keyframes on 'pose_frame'. Grip fcurves are
+        #     collected in the same pass so they don't need to be searched for again below
+        grip_fcurves = []
+        for i, fcurve in enumerate(ac.fcurves):
+            if fcurve.data_path.startswith(grip_prefix):
+                grip_fcurves.append((i, fcurve))
+            # Read all keyframe frames at once instead of going through keyframe points one by one
+            kf_frames = blender_auto_common.get_keyframe_data(fcurve)[:, 0]
+            kf_to_move_inds = np.flatnonzero(np.abs(kf_frames - pose_frame) <= 0.1)  # keyframes at 'pose_frame'
+            if kf_to_move_inds.size:
+                # if found a keyframe on 'pose_frame', deleting all other keyframes on channel (keeping
+                #     first one that is close enough), and moving that keyframe to Frame 1 and making control
+                #     handles even so there isn't any unwanted movement, done while the fcurve is rebuilt
+                blender_auto_common.keep_fcurve_keyframes(fcurve, kf_to_move_inds[:1], move_kf_to_frame_1)
             else:
                 # If did not find keyframe on 'pose_frame' on this fcurve, delete all other keyframes
                 #     on this channel that are not safety keyframe
-                for i in range(0, len(fcurve.keyframe_points))[::-1]:
-                    if math.isclose(fcurve.keyframe_points[i].co.x, 1.0, abs_tol=0.1):
-                        continue
-                    fcurve.keyframe_points.remove(fcurve.keyframe_points[i])
+                blender_auto_common.keep_fcurve_keyframes(fcurve, np.flatnonzero(np.abs(kf_frames - 1.0) <= 0.1))
         # Creating a keyframe for 'grip' pose bone at the desired length of the idle anim, and
         #     adding noise fcurve modifiers to that bones quaternion curves
-        for i, fcurve in enumerate(ac.fcurves):
-            if 'pose.bones["grip"]' in fcurve.data_path:
-                fcurve.keyframe_points.insert(frame=length, value=fcurve.keyframe_points[0].co_ui.y)
-                if 'pose.bones["grip"].rotation_quaternion' in fcurve.data_path:
-                    mod = fcurve.modifiers.new('NOISE')
-                    mod.scale = 40.0
-                    mod.strength = 0.05
-                    mod.phase = i
-                    mod.use_restricted_range = True
-                    mod.frame_start = 2.0
-                    mod.frame_end = length-1
-                    mod.blend_in = length/5
-                    mod.blend_out = length/5
+        for i, fcurve in grip_fcurves:
+            kf_points = fcurve.keyframe_points
+            if len(kf_points) == 1 and kf_points[0].co.x < length:
+                # Only the pose keyframe left, so new keyframe goes at the end, just add it and set it directly
+                #     instead of insert() searching for where it goes
+                kf_points.add(1)
+                kf_points[1].co = (length, kf_points[0].co.y)
+                fcurve.update()
+            else:
+                kf_points.insert(frame=length, value=kf_points[0].co_ui.y)
+            if fcurve.data_path == grip_rot_path:
+                mod = fcurve.modifiers.new('NOISE')
+                mod.scale = 40.0
+                mod.strength = 0.05
+                mod.phase = i
+                mod.use_restricted_range = True
+                mod.frame_start = 2.0
+                mod.frame_end = length-1
+                mod.blend_in = length/5
+                mod.blend_out = length/5
         if push_down:
             rig_obj.animation_data.action = ac
             blender_auto_common.push_action_to_nla(rig_obj)
 
 
-def calc_foot_speed(act=None, feet_names=('foot_ik.L', 'foot_ik.R'), marker_prefs=('LF', 'RF')):
+def get_fcurve_map(act):
+    """Return dict of (data_path, array_index) to fcurve for all fcurves in act"""
+    return {(fc.data_path, fc.array_index): fc for fc in act.fcurves}
+
+
+def calc_foot_speed(act=None, feet_names=('foot_ik.L', 'foot_ik.R'), marker_prefs=('LF', 'RF'), fc_map=None):
     """Calculates travel and speed in X and Y direction of feet IK when on the ground.
 
     FPS, as taken from render settings, will be used to determine speed.The frames where
@@ -99,6 +113,7 @@ def calc_foot_speed(act=None, feet_names=('foot_ik.L', 'foot_ik.R'), marker_pref
     :param act: action to calculate foot speeds from
     :param feet_name: tuple of feet bone names to get displacement from
     :param marker_prefs: tuple of marker prefixes corresponding to each foot in feet_names
+    :param fc_map: optional dict of (data_path, array_index) to fcurve of act, built if not given
     :return: Dictionary containing speeds, distances, and times of feet bones
     """
     if len(feet_names) != len(marker_prefs):
@@ -109,11 +124,13 @@ def calc_foot_speed(act=None, feet_names=('foot_ik.L', 'foot_ik.R'), marker_pref
         act = rig_obj.animation_data.action  # get current action if action=None
     else:
         act = bpy.data.actions[act]
+    if fc_map is None:
+        fc_map = get_fcurve_map(act)
     out = {}
     for ft_n, ft in enumerate(feet_names):
         out[ft] = {'x_delta': None, 'y_delta': None, 't_delta': None, 'x_speed': None, 'y_speed': None, 'speed_mag': None}
-        fc_x = act.fcurves.find('pose.bones["%s"].location' % ft, index=0)
-        fc_y = act.fcurves.find('pose.bones["%s"].location' % ft, index=1)
+        fc_x = fc_map.get(('pose.bones["%s"].location' % ft, 0))
+        fc_y = fc_map.get(('pose.bones["%s"].location' % ft, 1))
         down_marker_ind = act.pose_markers.find(marker_prefs[ft_n]+"_Down")
         up_marker_ind = act.pose_markers.find(marker_prefs[ft_n]+"_Up")
         if down_marker_ind < 0 or up_marker_ind < 0:
@@ -121,21 +138,16 @@ def calc_foot_speed(act=None, feet_names=('foot_ik.L', 'foot_ik.R'), marker_pref
             continue
         down_frame = act.pose_markers[down_marker_ind].frame
         up_frame = act.pose_markers[up_marker_ind].frame
-        x_kf_up = blender_auto_common.get_fcurve_keyframe_at_frame(up_frame, fc_x)[1]
-        x_kf_down = blender_auto_common.get_fcurve_keyframe_at_frame(down_frame, fc_x)[1]
-        y_kf_up = blender_auto_common.get_fcurve_keyframe_at_frame(up_frame, fc_y)[1]
-        y_kf_down = blender_auto_common.get_fcurve_keyframe_at_frame(down_frame, fc_y)[1]
-        if x_kf_up is None or x_kf_down is None or y_kf_up is None or y_kf_down is None:
+        # reads keyframes once per fcurve, then finds both marker frames with one binary search
+        x_up, x_down = blender_auto_common.values_at_keyframes(fc_x, (up_frame, down_frame))
+        y_up, y_down = blender_auto_common.values_at_keyframes(fc_y, (up_frame, down_frame))
+        if x_up is None or x_down is None or y_up is None or y_down is None:
             raise Exception("No key frames on fcurves at the up/down marker locations")
-        out[ft]['x_delta'] = x_kf_up.co[1] - x_kf_down.co[1]
-        out[ft]['y_delta'] = y_kf_up.co[1] - y_kf_down.co[1]
-        out[ft]['t_delta'] = float(up_frame) - float(down_frame)
-        if down_frame > up_frame:
-            out[ft]['t_delta'] += act.frame_range[1] - act.frame_range[0]
-        out[ft]['t_delta'] *= 1./float(fps)
-        out[ft]['x_speed'] = out[ft]['x_delta']/out[ft]['t_delta']
-        out[ft]['y_speed'] = out[ft]['y_delta']/out[ft]['t_delta']
-        out[ft]['speed_mag'] = math.sqrt(out[ft]['x_speed']**2 + out[ft]['y_speed']**2)
+        speeds = blender_auto_common.compute_foot_speeds(x_up, x_down, y_up, y_down, float(up_frame),
+                                                         float(down_frame), float(fps),
+                                                         float(act.frame_range[1] - act.frame_range[0]))
+        for key, val in zip(('x_delta', 'y_delta', 't_delta', 'x_speed', 'y_speed', 'speed_mag'), speeds):
+            out[ft][key] = val
     return out
 
 
@@ -143,30 +155,37 @@ def scale_foot_speed(tgt_speed, feet_names=('foot_ik.L', 'foot_ik.R'), marker_pr
     def delete_key_foot_down_kfs(frame_range, fcv):
         print("    Deleting keyframes on curve: " + fcv.data_path + "[" + str(fcv.array_index) + "] on " +
               str(frame_range))
-        for fr in frame_range:
-            kf = blender_auto_common.get_fcurve_keyframe_at_frame(fr, fcv)[1]
-            if kf is not None:
-                fc.keyframe_points.remove(kf)
+        # Mask of keyframes on any frame in frame_range, found for all keyframes at once, then rebuild fcurve with
+        #     the rest instead of removing keyframes one by one
+        kf_frames = blender_auto_common.get_keyframe_data(fcv)[:, 0].astype(np.float64)
+        nearest_frames = np.rint(kf_frames)
+        del_mask = np.isin(nearest_frames, np.fromiter(frame_range, dtype=np.float64)) \
+            & (np.abs(kf_frames - nearest_frames) <= 1e-9 * np.abs(nearest_frames))  # same as math.isclose
+        if del_mask.any():
+            blender_auto_common.keep_fcurve_keyframes(fcv, np.flatnonzero(~del_mask))
     dir_specifier = {'F': 1, 'B': 1, 'L': 0, 'R': 0}
     axis_specifier = ('x', 'y')
     if len(feet_names) != len(marker_prefs):
        raise Exception("feet_names and marker_prefs need to be the same size")
     rig_obj = blender_auto_common.find_object_in_mode('POSE')  # Get current pose mode rig
+    # Measure foot speeds of all actions first, before any fcurves are modified, then scale each action
+    #     using those measurements instead of calculating them again
+    acts = _nla_track_actions(rig_obj)
+    fc_maps = {act.name: get_fcurve_map(act) for act in acts}  # one pass over fcurves instead of a find per lookup
+    all_feet_speed = {act.name: calc_foot_speed(act.name, feet_names, marker_prefs, fc_maps[act.name])
+                      for act in acts}
     print("Current foot speeds:")
-    disp_all_action_foot_speed(feet_names, marker_prefs)
-    for nla_track in rig_obj.animation_data.nla_tracks:
-        if len(nla_track.strips) == 0:
-            continue
-        act = nla_track.strips[0].action
-        if act is None:
-            continue
+    for act in acts:
+        _print_foot_speeds(act.name, all_feet_speed[act.name], feet_names, marker_prefs)
+    for act in acts:
         move_dir = dir_specifier[act.name[-1]]
         print("Scaling foot speed for: " + act.name + " in direction: " + axis_specifier[move_dir])
-        feet_speed = calc_foot_speed(act.name, feet_names, marker_prefs)
+        fc_map = fc_maps[act.name]
+        feet_speed = all_feet_speed[act.name]
         for ft_n, ft in enumerate(feet_names):
             down_frame = act.pose_markers[marker_prefs[ft_n] + "_Down"].frame
             up_frame = act.pose_markers[marker_prefs[ft_n] + "_Up"].frame
-            fc = act.fcurves.find('pose.bones["%s"].location' % ft, index=move_dir)
+            fc = fc_map.get(('pose.bones["%s"].location' % ft, move_dir))
             if up_frame > down_frame:
                 delete_key_foot_down_kfs(range(up_frame - 1, down_frame, -1), fc)
             else:
@@ -183,22 +202,97 @@ def scale_foot_speed(tgt_speed, feet_names=('foot_ik.L', 'foot_ik.R'), marker_pr
     disp_all_action_foot_speed(feet_names, marker_prefs)
 
 
+def _nla_track_actions(rig_obj):
+    """Return actions of first strip of each nla track of rig_obj, each action only once, in track order"""
+    acts = []
+    for nla_track in rig_obj.animation_data.nla_tracks:
+        if len(nla_track.strips) == 0:
+            continue
+        act = nla_track.strips[0].action
+        if act is not None and act not in acts:
+            acts.append(act)
+    return acts
+
+
+def _print_foot_speeds(act_name, feet_speed, feet_names, marker_prefs):
+    print(act_name + ":")
+    for ft_n, ft in enumerate(feet_names):
+        if feet_speed[ft]['speed_mag'] is None:
+            continue
+        print("    " + marker_prefs[ft_n] + ": [ %.3f  %.3f ]  ->  %.3f" % (feet_speed[ft]['x_speed'],
+            feet_speed[ft]['y_speed'], feet_speed[ft]['speed_mag']))
+
+
 def disp_all_action_foot_speed(feet_names=('foot_ik.L', 'foot_ik.R'), marker_prefs=('LF', 'RF')):
     rig_obj = blender_auto_common.find_object_in_mode('POSE')  # Get current pose mode rig0
-    for nla_track in rig_obj.animation_data.nla_tracks:
-        if len(nla_track.strips) > 0:
-            act_name = nla_track.strips[0].action.name
-            feet_speed = calc_foot_speed(act_name, feet_names, marker_prefs)
-            print(act_name + ":")
-            for ft_n,ft in enumerate(feet_names):
-                if feet_speed[ft]['speed_mag'] is None:
-                    continue
-                print("    " + marker_prefs[ft_n] + ": [ %.3f  %.3f ]  ->  %.3f" % (feet_speed[ft]['x_speed'],
-                    feet_speed[ft]['y_speed'], feet_speed[ft]['speed_mag']))
+    for act in _nla_track_actions(rig_obj):
+        _print_foot_speeds(act.name, calc_foot_speed(act.name, feet_names, marker_prefs), feet_names, marker_prefs)
+
+
+def _action_keyframe_frame_inds(act, frames):
+    """Return sorted indices into frames (a range) of frames where act has keyframes, always with first and last"""
+    kf_frames = [np.rint(blender_auto_common.get_keyframe_data(fc)[:, 0]) for fc in act.fcurves]
+    inds = np.concatenate(kf_frames + [np.array([frames[0], frames[-1]])]).astype(np.int64) - frames[0]
+    return np.unique(inds[(inds >= 0) & (inds < len(frames))])
+
+
+def _interp_skipped_frames(locs, rots, bone_inds, eval_inds):
+    """Fill frames not in eval_inds of locs/rots [bone, frame, 3 or 4] arrays for bones in bone_inds, by lerping
+    locations and slerping rotations between the evaluated frames around them"""
+    all_inds = np.arange(locs.shape[1])
+    # evaluated frame before and after each frame, and how far along between them each frame is
+    after = np.clip(np.searchsorted(eval_inds, all_inds), 1, len(eval_inds) - 1)
+    before = after - 1
+    t = (all_inds - eval_inds[before]) / (eval_inds[after] - eval_inds[before])
+    for j in bone_inds:
+        for a in range(3):
+            locs[j, :, a] = np.interp(all_inds, eval_inds, locs[j, eval_inds, a])
+        rots[j] = blender_auto_common.slerp_np(rots[j, eval_inds[before]], rots[j, eval_inds[after]], t)
+
+
+@blender_auto_common.jit
+def _blend_and_scale(locs, rots, weight, scale_fac, midpoints):
+    """Blend feet locs and quats of 2 actions by weight and scale blended locs about midpoints by scale_fac.
+
+    locs and rots are [action, foot, frame, 3 or 4] arrays, returns blended [foot, frame, 3 or 4] arrays. Loops
+    written out for numba, without numba the same is done with numpy array ops in blend_feet_locations"""
+    n_feet = locs.shape[1]
+    n_frames = locs.shape[2]
+    locs_out = np.empty((n_feet, n_frames, 3))
+    rots_out = np.empty((n_feet, n_frames, 4))
+    for j in range(n_feet):
+        for k in range(n_frames):
+            for a in range(3):
+                bl_loc = locs[0, j, k, a] * (1 - weight) + locs[1, j, k, a] * weight
+                locs_out[j, k, a] = (bl_loc - midpoints[j, a]) * scale_fac[j] + midpoints[j, a]
+            # slerp, same as blender_auto_common.slerp_np
+            dot = 0.0
+            for a in range(4):
+                dot += rots[0, j, k, a] * rots[1, j, k, a]
+            sign = 1.0
+            if dot < 0:
+                dot = -dot
+                sign = -1.0  # shortest path
+            if dot > 1 - 1e-4:
+                s0 = 1 - weight
+                s1 = weight
+            else:
+                omega = math.acos(min(dot, 1.0))
+                sin_omega = math.sin(omega)
+                s0 = math.sin((1 - weight) * omega) / sin_omega
+                s1 = math.sin(weight * omega) / sin_omega
+            for a in range(4):
+                rots_out[j, k, a] = s0 * rots[0, j, k, a] + sign * s1 * rots[1, j, k, a]
+    return locs_out, rots_out
+
+
+# For each 90 deg move angle quadrant in blend_feet_locations, starting at -180 deg: action suffixes to blend between,
+#     angle where blending weight is 0 (all act1) and direction of increasing weight
+_move_angle_quadrants = (('L', 'B', -90, -1), ('F', 'L', 0, -1), ('F', 'R', 0, 1), ('R', 'B', 90, 1))
 
 
 def blend_feet_locations(act_prefix, move_angle, move_speed, foot_name='foot_ik',
-                         feet_timing=((0, 24), (24, 48))):
+                         feet_timing=((0, 24), (24, 48)), keyframes_only=False):
     """Create an action with feet transforms blended between directional movement actions.
 
     For locomotion animations, there should be actions defined for four movement directions (Forward,
@@ -212,86 +306,96 @@ def blend_feet_locations(act_prefix, move_angle, move_speed, foot_name='foot_ik'
     :param move_speed: mesh object speed that defines how quickly the feet move
     :param foot_name: name of the feet bones
     :param feet_timing: container with frames where ((LF Down, LF Up), (RF Down, RF Up))
+    :param keyframes_only: for feet bones that need the scene evaluated at each frame (e.g. constrained), only
+        evaluate at frames where the action has keyframes and interpolate in between (lerp locations, slerp
+        rotations). Much faster for sparsely keyed actions but only approximate, since constraints and bezier
+        fcurves don't move linearly between keyframes
     """
 
     # Get adjacent move direction action given move_angle and calculate blending weight
-    if 0 <= move_angle <= 90:
-        weight = move_angle/90
-        act1_name = act_prefix + 'F'
-        act2_name = act_prefix + 'R'
-    elif 90 <= move_angle <= 181:
-        weight = (move_angle - 90)/90
-        act1_name = act_prefix + 'R'
-        act2_name = act_prefix + 'B'
-    elif -90 <= move_angle <= 0:
-        weight = move_angle/-90
-        act1_name = act_prefix + 'F'
-        act2_name = act_prefix + 'L'
-    elif -181 <= move_angle <= -90:
-        weight = (move_angle + 90)/-90
-        act1_name = act_prefix + 'L'
-        act2_name = act_prefix + 'B'
+    if -181 <= move_angle <= 181:
+        # quadrants: [-181, -90), [-90, 0), [0, 90], (90, 181]
+        quadrant = 3 if move_angle > 90 else max(min(int(math.floor((move_angle + 180)/90)), 2), 0)
+        act1_suff, act2_suff, zero_weight_angle, weight_dir = _move_angle_quadrants[quadrant]
+        weight = (move_angle - zero_weight_angle)/(90*weight_dir)
     else:
-        weight = 0
-        act1_name = act_prefix + 'F'
-        act2_name = act_prefix + 'R'
+        act1_suff, act2_suff, weight = 'F', 'R', 0
+    act1_name = act_prefix + act1_suff
+    act2_name = act_prefix + act2_suff
 
     weight = max(min(1, weight), 0)
     bones = [foot_name + '.L', foot_name + '.R']
     rig_obj = blender_auto_common.find_object_in_mode('POSE')
     act1 = bpy.data.actions[act1_name]
     act2 = bpy.data.actions[act2_name]
-    fps = bpy.context.scene.render.fps
-
-    # Below functions do the actual blending
-    def blend_loc(bm1, bm2):
-        return bm1.translation * (1 - weight) + bm2.translation * weight
-
-    def blend_rot(bm1, bm2):
-        return bm1.to_quaternion().slerp(bm2.to_quaternion(), weight)
-
-    # Step through anim frame by frame, collecting bone transform data from feet bones
-    bone_transforms = [[[], []],
-                       [[], []]]  # bone_transforms[action][LF or RF]; LF: index 0, RF: index 1
+    scene = bpy.context.scene
+    frame_set = scene.frame_set
+    fps = scene.render.fps
+
+    # Collect bone transform data from feet bones, sampling fcurves directly if possible, otherwise stepping
+    #    through anim frame by frame. Action needs to be active for sample_pose_bone_matrices to decide if sampling
+    #    it directly matches frame_set. Stored as arrays indexed [action, LF or RF, frame - frame_start]
+    frame_start = scene.frame_start
+    frames = range(frame_start, scene.frame_end + 2)
+    locs = np.empty((2, len(bones), len(frames), 3))
+    rots = np.empty((2, len(bones), len(frames), 4))  # quaternion wxyz
     for i, act in enumerate([act1, act2]):
         rig_obj.animation_data.action = act
-        for fr in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end + 2):
-            bpy.context.scene.frame_set(fr)
-            for j, bone in enumerate(bones):
-                pb = rig_obj.pose.bones[bone]
-                bone_transforms[i][j].append(pb.matrix.copy())
+        sampled = blender_auto_common.sample_pose_bone_matrices(rig_obj, act, bones, frames)
+        for j, bone in enumerate(bones):
+            if bone in sampled:
+                locs[i, j] = [mat.to_translation() for mat in sampled[bone]]
+                rots[i, j] = [mat.to_quaternion() for mat in sampled[bone]]
+        frame_set_bones = [(j, rig_obj.pose.bones[bone]) for j, bone in enumerate(bones) if bone not in sampled]
+        if not frame_set_bones:
+            continue
+        eval_inds = _action_keyframe_frame_inds(act, frames) if keyframes_only else np.arange(len(frames))
+        for k in eval_inds:
+            frame_set(frames[k])
+            for j, pb in frame_set_bones:
+                mat = pb.matrix
+                locs[i, j, k] = mat.to_translation()
+                rots[i, j, k] = mat.to_quaternion()
+        if len(eval_inds) < len(frames):
+            _interp_skipped_frames(locs[i], rots[i], [j for j, _ in frame_set_bones], eval_inds)
 
     # Calculate scale factor needed to scale blended feet movement locations such that the
     #    feet motion speed correspond to move_speed
-    scale_fac = []  # LF: index 0, RF: index 1
-    midpoints = []
-    for j, bone in enumerate(bones):
-        down_fr, up_fr = feet_timing[j]
-        # First get total feet displacement on ground (delta_loc)
-        down_loc = blend_loc(bone_transforms[0][j][down_fr], bone_transforms[1][j][down_fr]).to_2d()
-        up_loc = blend_loc(bone_transforms[0][j][up_fr], bone_transforms[1][j][up_fr]).to_2d()
-        delta_loc = up_loc - down_loc
-        # Calc midpoint (will use this to recenter data when scaling)
-        midpoints.append(down_loc + delta_loc/2)
-        delta_time = (feet_timing[j][1] - feet_timing[j][0])/fps
-        bl_speed = delta_loc.magnitude/delta_time
-        scale_fac.append(move_speed/bl_speed)
-
-    # Create new action and blend feet transform, then scale them
+    #    (all arrays below indexed by foot, LF: index 0, RF: index 1)
+    down_frs, up_frs = np.array(feet_timing[:len(bones)]).T
+    foot_inds = np.arange(len(bones))
+    # First get total feet displacement on ground (delta_loc), only need blended locations at down/up frames
+    down_locs = locs[0, foot_inds, down_frs - frame_start, :2] * (1 - weight) \
+        + locs[1, foot_inds, down_frs - frame_start, :2] * weight
+    up_locs = locs[0, foot_inds, up_frs - frame_start, :2] * (1 - weight) \
+        + locs[1, foot_inds, up_frs - frame_start, :2] * weight
+    delta_locs = up_locs - down_locs
+    # Calc midpoints (will use this to recenter data when scaling), z of midpoint stays 0, only scaling in xy
+    midpoints = np.zeros((len(bones), 3))
+    midpoints[:, :2] = down_locs + delta_locs/2
+    delta_times = (up_frs - down_frs)/fps
+    bl_speeds = np.linalg.norm(delta_locs, axis=-1)/delta_times
+    scale_fac = move_speed/bl_speeds
+
+    # Blend feet transforms of both actions for all frames and scale blended locations
+    if blender_auto_common.numba is None:
+        bl_locs = locs[0] * (1 - weight) + locs[1] * weight
+        bl_locs = (bl_locs - midpoints[:, None, :]) * scale_fac[:, None, None] + midpoints[:, None, :]
+        bl_rots = np.stack([blender_auto_common.slerp_np(rots[0, j], rots[1, j], weight) for j in range(len(bones))])
+    else:
+        bl_locs, bl_rots = _blend_and_scale(locs, rots, weight, scale_fac, midpoints)
+
+    # Create new action and key blended and scaled feet transforms
     bl_act = bpy.data.actions.new(act_prefix + '_%i' % move_angle)
     rig_obj.animation_data.action = bl_act
-    for fr in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end + 2):
-        bpy.context.scene.frame_set(fr)
-        for j, bone in enumerate(bones):
-            mat1 = bone_transforms[0][j][fr]
-            mat2 = bone_transforms[1][j][fr]
-            mid = midpoints[j].to_3d()
-            bl_loc = (blend_loc(mat1, mat2) - mid) * scale_fac[j] + mid
-            bl_rot = blend_rot(mat1, mat2)
-            bn = rig_obj.pose.bones[bone]
-            bn.matrix = mathutils.Matrix.LocRotScale(bl_loc, bl_rot, None)
-            bn.keyframe_insert('location')
-            bn.keyframe_insert('rotation_quaternion')
+    parent_mats = blender_auto_common.sample_pose_bone_parent_matrices(rig_obj, bl_act, bones, frames)
+    for j, bone in enumerate(bones):
+        bl_mats = blender_auto_common.loc_quats_to_matrices(bl_locs[j], bl_rots[j])
+        blender_auto_common.key_pose_bone_matrices(rig_obj, bl_act, bone, frames, bl_mats, parent_mats[bone])
+
+
+# Allowed custom prop value types and the type name written to the xml for them
+_custom_prop_type_names = {int: 'int', float: 'float', str: 'str'}
 
 
 def create_anim_bone_transform_xml(filepath, anim_group_dict):
@@ -327,7 +431,8 @@ def create_anim_bone_transform_xml(filepath, anim_group_dict):
                                         doesn't play well with unreal engine. Note, ordering of Rot elems should be
                                         QX, QY, QZ, QW and for LocRot, Rot elems should be first: QX, QY, QZ, QW,
                                         X, Y, Z.
-                                        'data': Float itterable containing bone transform matrix elements flattened
+                                        'data': Float itterable (e.g. list or numpy array) containing bone
+                                        transform matrix elements flattened
                                     }
                                 ....
                             }
@@ -340,36 +445,40 @@ def create_anim_bone_transform_xml(filepath, anim_group_dict):
     :param anim_group_dict: see above
     """
 
-    def write_custom_props(prop_dict, fhandle, level, tag):
-        f.write('\t' * level + '<%s>\n' % tag)
+    def write_custom_props(prop_dict, parts, level, tag):
+        indent = '\t' * level
+        tpl = indent + '\t<prop name="%s" type="%s">%s</prop>\n'
+        parts.append(indent + '<%s>\n' % tag)
         for key, val in prop_dict.items():
-            if type(val) not in [int, float, str]:
+            type_name = _custom_prop_type_names.get(type(val))
+            if type_name is None:
                 raise Exception('Custom prop val can only be int, float, or string, detected: %s for prop: %s'
                                 % (type(val).__name__, key))
-            fhandle.write('\t' * (level + 1))
-            fhandle.write('<prop name="%s" type="%s">' % (key, type(val).__name__))
-            fhandle.write(str(val) + "</prop>\n")
-        f.write('\t' * level + '</%s>\n' % tag)
-
+            parts.append(tpl % (key, type_name, val))
+        parts.append(indent + '</%s>\n' % tag)
+
+    # Build up whole xml as list of strings and write it to file once
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n', '<animation_group>\n']
+    if 'custom_props' in anim_group_dict.keys():
+        if anim_group_dict['custom_props']:
+            write_custom_props(anim_group_dict['custom_props'], parts, 1, 'anim_group_props')
+    for anim_name, anim_dict in anim_group_dict['anims'].items():
+        parts.append('\t<animation name="%s">\n' % anim_name)
+        if 'custom_props' in anim_dict.keys():
+            if anim_dict['custom_props']:
+                write_custom_props(anim_dict['custom_props'], parts, 2, 'anim_props')
+        for bone_name, bone_tform_data in anim_dict['bone_tforms'].items():
+            parts.append('\t\t<bone_transforms bone="%s" num_frames="%i" type="%s">'
+                         % (bone_name, bone_tform_data['num_frames'], bone_tform_data['type']))
+            tform_data = bone_tform_data['data']
+            # numpy arrays converted with tolist() since that's much faster than making a tuple of numpy scalars
+            tform_data = tuple(tform_data.tolist() if isinstance(tform_data, np.ndarray) else tform_data)
+            parts.append(("%.6f " * len(tform_data)) % tform_data)  # format all elems in one op
+            parts.append('</bone_transforms>\n')
+        parts.append('\t</animation>\n')
+    parts.append('</animation_group>\n')
     with open(filepath, 'w') as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write('<animation_group>\n')
-        if 'custom_props' in anim_group_dict.keys():
-            if anim_group_dict['custom_props']:
-                write_custom_props(anim_group_dict['custom_props'], f, 1, 'anim_group_props')
-        for anim_name, anim_dict in anim_group_dict['anims'].items():
-            f.write('\t<animation name="%s">\n' % anim_name)
-            if 'custom_props' in anim_dict.keys():
-                if anim_dict['custom_props']:
-                    write_custom_props(anim_dict['custom_props'], f, 2, 'anim_props')
-            for bone_name, bone_tform_data in anim_dict['bone_tforms'].items():
-                f.write('\t\t<bone_transforms bone="%s" num_frames="%i" type="%s">'
-                        % (bone_name, bone_tform_data['num_frames'], bone_tform_data['type']))
-                for el in bone_tform_data['data']:
-                    f.write("%.6f " % el)
-                f.write('</bone_transforms>\n')
-            f.write('\t</animation>\n')
-        f.write('</animation_group>\n')
+        f.write(''.join(parts))
 
 
 def export_foot_location_xml(anim_group_name, feet_timing, filepath):
@@ -388,7 +497,9 @@ def export_foot_location_xml(anim_group_name, feet_timing, filepath):
     :param filepath: where to save the xml file
     """
 
-    fps = bpy.context.scene.render.fps
+    scene = bpy.context.scene
+    frame_set = scene.frame_set
+    fps = scene.render.fps
     rig_obj = blender_auto_common.find_object_in_mode('POSE')
     bone_names = ['DEF-foot.L', 'DEF-foot.R', 'TGT-thigh_ik_target.L', 'TGT-thigh_ik_target.R']
     anims = [(anim_group_name + dir_suff) for dir_suff in ['F', 'L', 'R', 'B']]
@@ -407,30 +518,42 @@ def export_foot_location_xml(anim_group_name, feet_timing, filepath):
                 },
             'anims': {}
         }
+    frames = range(scene.frame_start, scene.frame_end + 2)
+    num_frames = scene.frame_end + 2
     for anim_name in anims:
-        bone_transforms['anims'][anim_name] = {'bone_tforms': {}, 'custom_props': {'direction': anim_name[-1]}}
-        for bn in bone_names:
-            bone_transforms['anims'][anim_name]['bone_tforms'][bn] = \
+        act = bpy.data.actions[anim_name]
+        rig_obj.animation_data.action = act
+        # Collect bone locations as [bone, frame, xyz], sampling fcurves directly if possible, otherwise stepping
+        #     through anim frame by frame
+        locs = np.empty((len(bone_names), len(frames), 3))
+        sampled = blender_auto_common.sample_pose_bone_locations(rig_obj, act, bone_names, frames)
+        for j, bn in enumerate(bone_names):
+            if bn in sampled:
+                locs[j] = sampled[bn]
+        frame_set_bones = [(j, rig_obj.pose.bones[bn]) for j, bn in enumerate(bone_names) if bn not in sampled]
+        if frame_set_bones:
+            for k, fr in enumerate(frames):
+                frame_set(fr)
+                for j, pb in frame_set_bones:
+                    locs[j, k] = pb.matrix.translation
+        # To unreal component frame and units, y flip and m to cm in one multiply
+        locs *= (100., -100., 100.)
+        bone_tforms = {}
+        bone_transforms['anims'][anim_name] = {'bone_tforms': bone_tforms, 'custom_props': {'direction': anim_name[-1]}}
+        for j, bn in enumerate(bone_names):
+            bone_tforms[bn] = \
                 {
-                    'num_frames': bpy.context.scene.frame_end + 2,
+                    'num_frames': num_frames,
                     'type': 'Loc',
-                    'data': []
+                    'data': locs[j].ravel()
                 }
-        act = bpy.data.actions[anim_name]
-        rig_obj.animation_data.action = act
-        for fr in range(bpy.context.scene.frame_start, bpy.context.scene.frame_end + 2):
-            bpy.context.scene.frame_set(fr)
-            for bn in bone_names:
-                bn_vec = rig_obj.pose.bones[bn].matrix.translation.copy()
-                bn_vec[1] = - bn_vec[1]
-                bn_vec = 100 * bn_vec
-                for el in bn_vec:
-                    bone_transforms['anims'][anim_name]['bone_tforms'][bn]['data'].append(el)
     create_anim_bone_transform_xml(filepath, bone_transforms)
 
 def clear_action_stash():
     rig_obj = blender_auto_common.find_object_in_mode('POSE')
     nla_tracks = rig_obj.animation_data.nla_tracks
-    for track in nla_tracks:
-        if '[Action Stash]' in track.name:
-            nla_tracks.remove(track)
\ No newline at end of file
+    # Collect tracks first so collection isn't modified while iterating, blender names stash tracks
+    #     '[Action Stash]' (with .001 etc. suffixes for more than one)
+    stash_tracks = [track for track in nla_tracks if track.name.startswith('[Action Stash]')]
+    for track in stash_tracks:
+        nla_tracks.remove(track)
\ No newline at end of file